@@ -1,27 +1,24 @@
 import xarray as xr
 import numpy as np
 import matplotlib.pyplot as plt
+from utils.processing import compute_zonal_climatology
+from utils.regrid import regrid_conservative
 
 model_ds = xr.open_dataset(r"C:\Users\Aliya-LOCAL\Code\ukca_evaluation\data\u-dr061_O3_tropo_DU.nc")
 obs_ds   = xr.open_dataset(r"C:\Users\Aliya-LOCAL\Code\ukca_evaluation\data\OMI_MLS_ozone.nc")
 
-# Get variables and compute zonal means
+# Get variables and compute zonal mean climatology
 obs_ozone = obs_ds['ozone_column']
-obs_zonal = obs_ozone.mean(dim='longitude')
+obs_clim  = compute_zonal_climatology(obs_ozone, {'time': 't'})  # shape: (12, nlat_obs)
 
-obs_month = obs_ds['t.month']
-obs_clim  = obs_zonal.groupby(obs_month).mean('t')  # shape: (12, nlat_obs)
-
-# interpolate obs climatology to model latitude grid for direct comparison
+# conservatively regrid obs climatology to model latitude grid for direct comparison
 lats = model_ds['latitude']
-obs_clim_interp = obs_clim.interp(latitude=lats)
+obs_clim_interp = regrid_conservative(obs_clim, lats.values)
 
 # Use model's climatology range for consistent colourbar and comparison
 # If you want the colourbar to be identical to the model plot, use the same vmin/vmax/levels:
 model_ozone = model_ds['troposphere_only_ozone_column']
-model_zonal = model_ozone.mean(dim='longitude')
-model_month = model_ds['time.month']
-model_clim = model_zonal.groupby(model_month).mean('time')
+model_clim = compute_zonal_climatology(model_ozone)
 
 vmin = np.floor(model_clim.min().item())
 vmax = np.ceil(model_clim.max().item())
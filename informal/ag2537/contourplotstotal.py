@@ -1,6 +1,8 @@
 import xarray as xr
 import numpy as np
 import matplotlib.pyplot as plt
+from utils.processing import compute_zonal_climatology
+from utils.regrid import regrid_conservative
 
 model_ds = xr.open_dataset(r"C:\Users\Aliya-LOCAL\Code\ukca_evaluation\data\u-dr061_O3_total_DU.nc")
 obs_ds   = xr.open_dataset(r"C:\Users\Aliya-LOCAL\Code\ukca_evaluation\data\u-dr226_O3_total_DU.nc")
@@ -8,17 +10,11 @@ obs_ds   = xr.open_dataset(r"C:\Users\Aliya-LOCAL\Code\ukca_evaluation\data\u-dr
 model_ozone = model_ds['total_ozone_column']          
 obs_ozone   = obs_ds['TCO'].squeeze('longitude')      
 
-model_zonal = model_ozone.mean(dim='longitude')       
-obs_zonal   = obs_ozone                             
-
-model_month = model_ds['time.month']
-obs_month   = obs_ds['time.month']
-
-model_clim = model_zonal.groupby(model_month).mean('time')   # (12, nlat_model)
-obs_clim   = obs_zonal.groupby(obs_month).mean('time')       # (12, nlat_obs)
+model_clim = compute_zonal_climatology(model_ozone)   # (12, nlat_model)
+obs_clim   = compute_zonal_climatology(obs_ozone)     # (12, nlat_obs), already zonal
 
 lats = model_ds['latitude']
-obs_clim_interp = obs_clim.interp(latitude=lats)
+obs_clim_interp = regrid_conservative(obs_clim, lats.values)
 
 bias = model_clim - obs_clim_interp
 
@@ -1,20 +1,18 @@
 import xarray as xr
 import numpy as np
 import matplotlib.pyplot as plt
+from utils.processing import compute_zonal_climatology
 
 model_ds = xr.open_dataset(r"C:\Users\Aliya-LOCAL\Code\ukca_evaluation\data\u-dr226_O3_total_DU.nc")
 obs_ds   = xr.open_dataset(r"C:\Users\Ifon\OneDrive - King's College London\Documents\UKESM REP\ObsData\ObsData\Boedecker\BSCO_V2.8_mm2.nc")
 
 
 obs_ozone = obs_ds['TCO'].squeeze('longitude')      
-obs_month = obs_ds['time.month']
-obs_clim  = obs_ozone.groupby(obs_month).mean('time')   
+obs_clim  = compute_zonal_climatology(obs_ozone)
 lats = obs_ds['latitude']
 
 model_ozone = model_ds['total_ozone_column']          
-model_zonal = model_ozone.mean(dim='longitude')
-model_month = model_ds['time.month']
-model_clim  = model_zonal.groupby(model_month).mean('time')
+model_clim  = compute_zonal_climatology(model_ozone)
 vmin = np.floor(model_clim.min().item())
 vmax = np.ceil(model_clim.max().item())
 levels = np.linspace(vmin, vmax, 30)
@@ -1,87 +1,90 @@
-import xarray as xr
 import numpy as np
 import matplotlib.pyplot as plt
+from utils.processing import zonal_climatology, reduce_models
+from utils.regrid import regrid_conservative
 
-model_path = r"C:\Users\Aliya-LOCAL\Code\ukca_evaluation\data\u-dr226_O3_tropo_DU.nc"
-obs_path   = r"C:\Users\Aliya-LOCAL\Code\ukca_evaluation\data\u-dr061_O3_tropo_DU.nc"
+# Runs to compare; every run after the first is compared with the first. Another
+# run is one more entry (and one more reduction), e.g. {'name': ..., 'member': ..., 'file': ...}
+runs = [
+    {'name': 'UKESM1.1', 'file': r"C:\Users\Aliya-LOCAL\Code\ukca_evaluation\data\u-dr061_O3_tropo_DU.nc"},
+    {'name': 'UKESM1.3', 'file': r"C:\Users\Aliya-LOCAL\Code\ukca_evaluation\data\u-dr226_O3_tropo_DU.nc"},
+]
 
-model_var = 'troposphere_only_ozone_column'
-obs_var   = 'troposphere_only_ozone_column'
-model_lat  = 'latitude'
-obs_lat    = 'latitude'        
-model_time = 'time'
-obs_time   = 'time'               
+var_name = 'troposphere_only_ozone_column'
+lat_dim  = 'latitude'
+dims     = {'time': 'time'}
 
-model_ds = xr.open_dataset(model_path)
-obs_ds   = xr.open_dataset(obs_path)
+# Each run's climatology is reduced in its own worker (or read from the cache)
+# and stacked along "model"
+clims = reduce_models(zonal_climatology, runs, var_name=var_name, dims=dims)['climatology']
 
-model_ozone = model_ds[model_var]
-obs_ozone   = obs_ds[obs_var]
+def run_clim(label):
+    # Runs on different grids are NaN at each other's latitudes once stacked
+    return clims.sel(model=label).dropna(lat_dim, how='all')
 
-model_zonal = model_ozone.mean(dim='longitude')
-obs_zonal   = obs_ozone.mean(dim='longitude')
-
-model_month = model_ds[model_time + '.month']
-obs_month   = obs_ds[obs_time + '.month']
-
-model_clim = model_zonal.groupby(model_month).mean(model_time)
-obs_clim   = obs_zonal.groupby(obs_month).mean(obs_time)
-
-if not np.allclose(model_ds[model_lat], obs_ds[obs_lat]):
-    obs_clim = obs_clim.interp({obs_lat: model_ds[model_lat]})
-
-
-diff = model_clim - obs_clim
-
-print("Model clim shape:", model_clim.shape)
-print("Obs clim shape:", obs_clim.shape)
-print("Diff shape:", diff.shape)
-print("Any NaN in model_clim?", np.isnan(model_clim).any().item())
-print("Any NaN in obs_clim?", np.isnan(obs_clim).any().item())
-print("Any NaN in diff?", np.isnan(diff).any().item())
-print("Min/max of diff:", np.nanmin(diff), np.nanmax(diff))
-
-
-vmin = np.floor(model_clim.min().item())
-vmax = np.ceil(model_clim.max().item())
-levels = np.linspace(vmin, vmax, 30)
-
-pad = 0.05
-diff_min = diff.min().item()   
-diff_max = diff.max().item()   
-diff_levels = np.linspace(diff_min-pad, diff_max+pad, 31)
+ref_label = clims.model.values[0]
+ref_clim = run_clim(ref_label)
+labels = clims.model.values[1:]
 
 months = np.arange(1, 13)
-lats   = model_ds[model_lat]
-
-fig, axs = plt.subplots(1, 2, figsize=(14, 6), sharey=True)
-
-# Panel (a): Model
-cf1 = axs[0].contourf(
-    months, lats, model_clim.T,
-    levels=levels, cmap='Reds', extend='both'
-)
-axs[0].contour(months, lats, model_clim.T, levels=levels, colors='white', linewidths=0.6)
-axs[0].set_title('Model Total Ozone O3')
-axs[0].set_ylabel('Latitude (°)')
-axs[0].set_xlabel('Month')
-axs[0].set_xticks(months)
-axs[0].set_xticklabels(['Jan','Feb','Mar','Apr','May','Jun','Jul','Aug','Sep','Oct','Nov','Dec'])
-cbar1 = fig.colorbar(cf1, ax=axs[0], pad=0.02)
-cbar1.set_label('(DU)')
-
-# Panel (b): 1.3 - 1.1
-cf2 = axs[1].contourf(
-    months, lats, diff.T,
-    levels=diff_levels, cmap='RdBu_r', extend='both'
-)
-axs[1].contour(months, lats, diff.T, levels=diff_levels, colors='white', linewidths=0.6)
-axs[1].set_title('UKESM1.1 and UKESM1.3 Difference - Tropospheric Ozone')
-axs[1].set_xlabel('Month')
-axs[1].set_xticks(months)
-axs[1].set_xticklabels(['Jan','Feb','Mar','Apr','May','Jun','Jul','Aug','Sep','Oct','Nov','Dec'])
-cbar2 = fig.colorbar(cf2, ax=axs[1], pad=0.02)
-cbar2.set_label('(DU)')
+month_names = ['Jan','Feb','Mar','Apr','May','Jun','Jul','Aug','Sep','Oct','Nov','Dec']
+
+fig, axs = plt.subplots(len(labels), 2, figsize=(14, 6 * len(labels)), sharey=True, squeeze=False)
+
+for row, label in zip(axs, labels):
+    model_clim = run_clim(label)
+    lats = model_clim[lat_dim]
+
+    obs_clim = ref_clim
+    if not np.array_equal(ref_clim[lat_dim], lats):
+        obs_clim = regrid_conservative(ref_clim, lats.values, lat_dim=lat_dim)
+
+    diff = model_clim - obs_clim
+
+    print(f"{label} vs {ref_label}")
+    print("Model clim shape:", model_clim.shape)
+    print("Obs clim shape:", obs_clim.shape)
+    print("Diff shape:", diff.shape)
+    print("Any NaN in model_clim?", np.isnan(model_clim).any().item())
+    print("Any NaN in obs_clim?", np.isnan(obs_clim).any().item())
+    print("Any NaN in diff?", np.isnan(diff).any().item())
+    print("Min/max of diff:", np.nanmin(diff), np.nanmax(diff))
+
+    vmin = np.floor(model_clim.min().item())
+    vmax = np.ceil(model_clim.max().item())
+    levels = np.linspace(vmin, vmax, 30)
+
+    pad = 0.05
+    diff_min = diff.min().item()
+    diff_max = diff.max().item()
+    diff_levels = np.linspace(diff_min-pad, diff_max+pad, 31)
+
+    # Panel (a): Model
+    cf1 = row[0].contourf(
+        months, lats, model_clim.T,
+        levels=levels, cmap='Reds', extend='both'
+    )
+    row[0].contour(months, lats, model_clim.T, levels=levels, colors='white', linewidths=0.6)
+    row[0].set_title(f'{label} Total Ozone O3')
+    row[0].set_ylabel('Latitude (°)')
+    row[0].set_xlabel('Month')
+    row[0].set_xticks(months)
+    row[0].set_xticklabels(month_names)
+    cbar1 = fig.colorbar(cf1, ax=row[0], pad=0.02)
+    cbar1.set_label('(DU)')
+
+    # Panel (b): model - reference
+    cf2 = row[1].contourf(
+        months, lats, diff.T,
+        levels=diff_levels, cmap='RdBu_r', extend='both'
+    )
+    row[1].contour(months, lats, diff.T, levels=diff_levels, colors='white', linewidths=0.6)
+    row[1].set_title(f'{ref_label} and {label} Difference - Tropospheric Ozone')
+    row[1].set_xlabel('Month')
+    row[1].set_xticks(months)
+    row[1].set_xticklabels(month_names)
+    cbar2 = fig.colorbar(cf2, ax=row[1], pad=0.02)
+    cbar2.set_label('(DU)')
 
 plt.tight_layout()
 plt.show()
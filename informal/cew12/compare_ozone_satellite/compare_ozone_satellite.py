@@ -15,71 +15,44 @@ import datetime
 import iris
 import iris.quickplot
 import matplotlib.pyplot as plt
+import numpy as np
 import os
+import sys
+import xarray as xr
+
+from obs_archive import load_archive_subset
+
+# Shared helpers from the repo root's utils package; put the repo root on the
+# path so this still runs standalone from its own folder
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..")))
+from utils.processing import reduce_models
+from utils.time_align import monthly_period_index, period_start
 
 
 model_output_root = "/gws/nopw/j04/ukca_vol2/2025-07-ukesm-eval/model_output"
-models_total_O3_DU = {"UKESM-1.1": "u-dr061/2005_2014_O3/u-dr061_O3_total_DU.nc",
-                      "UKESM-1.3": "u-dr226/2005_2014_O3/u-dr226_O3_total_DU.nc" }
-models_tropo_O3_DU = {"UKESM-1.1": "u-dr061/2005_2014_O3/u-dr061_O3_tropo_DU.nc",
-                      "UKESM-1.3": "u-dr226/2005_2014_O3/u-dr226_O3_tropo_DU.nc" }
+# Model runs (and optionally ensemble members) to compare, with their total and
+# tropospheric column files under model_output_root; another run is one more entry
+models = [{"name": "UKESM-1.1",
+           "total": "u-dr061/2005_2014_O3/u-dr061_O3_total_DU.nc",
+           "tropo": "u-dr061/2005_2014_O3/u-dr061_O3_tropo_DU.nc"},
+          {"name": "UKESM-1.3",
+           "total": "u-dr226/2005_2014_O3/u-dr226_O3_total_DU.nc",
+           "tropo": "u-dr226/2005_2014_O3/u-dr226_O3_tropo_DU.nc"}]
+model_colors = ["darkblue", "green", "darkorange", "purple", "brown", "magenta"]
 
 bodeker_total_O3_folder = "/gws/nopw/j04/ukca_vol2/Observational_datasets/Other/BodekerScientific_Total_Column_Ozone"
 bodeker_total_O3_wildcard = "BSFilledTCO_V3.4.1_*_Monthly.nc"
 bodeker_total_O3_wildpath = os.path.join(bodeker_total_O3_folder, bodeker_total_O3_wildcard)
 
+bodeker_total_O3_name = "Total column ozone"
+
 omi_tropo_O3_path = "/gws/nopw/j04/ukca_vol2/Observational_datasets/Satellite/OMI_MLS_Tropospheric_Ozone_Column/OMI_MLS_ozone.nc"
+omi_tropo_O3_name = "ozone_column"
 
 
 def main(args):
     """Main entry point"""
 
-    model_total_O3_cube = {}
-    earliest_overall_time = None
-    latest_overall_time   = None
-    for model, subpath in models_total_O3_DU.items():
-        model_cube = load_model_O3_cube(subpath)
-        model_total_O3_cube[model] = model_cube
-
-        # Get time bounds for model cubes loaded so far    
-        earliest_model_time_cell = model_cube.coord("time").cell(0)
-        earliest_model_bounds = earliest_model_time_cell[1] # Seem to get mid value in el 0, bounds here
-        earliest_model_time = earliest_model_bounds[0] # tuple of (lower, upper) bounds
-        latest_model_time_cell = model_cube.coord("time").cell(-1)
-        latest_model_bounds = latest_model_time_cell[1]
-        latest_model_time = latest_model_bounds[1]
-        if not earliest_overall_time or earliest_model_time < earliest_overall_time:
-            earliest_overall_time = earliest_model_time
-        if not latest_overall_time or latest_model_time > latest_overall_time:
-            latest_overall_time = latest_model_time
-
-    # We know have same time ranges for tropo subset
-    model_tropo_O3_cube = {}
-    for model, subpath in models_tropo_O3_DU.items():
-        model_cube = load_model_O3_cube(subpath)
-        model_tropo_O3_cube[model] = model_cube
-
-    # Only load observation data that falls within model time bounds
-    # (we know observation data is wider in time)
-    model_time_constraint = iris.Constraint(time=lambda cell: earliest_overall_time <= cell.point < latest_overall_time)
-    observation_total_O3_dataset = iris.load(bodeker_total_O3_wildpath, model_time_constraint)
-
-    # Different coordinate name for OMI
-    model_t_constraint = iris.Constraint(t=lambda cell: earliest_overall_time <= cell.point < latest_overall_time)
-    observation_tropo_O3_dataset = iris.load(omi_tropo_O3_path, model_t_constraint)
-
-    # Extra processing needed for Bodecker total O3 data...
-    # End up with series of n cubes uncertainty (could be good for error bars)
-    # then n for data, so need to coalesce. This is a bit of a nasty hack because
-    # I'm using prior knowledge of that layout and depending on it
-    num_total_O3_cubes = int(len(observation_total_O3_dataset) / 2)
-    # Iris seems unnecessarily strict but won't merge/concat cubes with different
-    # 'created' timestamp strings, so getting rid of those:
-    for cube in observation_total_O3_dataset:
-        del cube.attributes["created"]
-    observation_total_O3_cube    = observation_total_O3_dataset[num_total_O3_cubes : ].concatenate_cube()
-    observation_total_sigma_cube = observation_total_O3_dataset[ : num_total_O3_cubes].concatenate_cube()
-
     latitude_ranges_total_O3 = [(-90,  90),
                                 (-90, -60),
                                 (-60, -30),
@@ -93,19 +66,46 @@ def main(args):
                                 (-30,  30),
                                 ( 30,  60)]
 
+    # Latitude-band series of every model, each reduced in its own worker
+    # process and stacked along "model"; done before this process opens any
+    # data, as the workers are forked
+    model_total_O3_series = reduce_models(model_band_series, [model_job(model, "total") for model in models],
+                                          latitude_ranges=latitude_ranges_total_O3)
+    model_tropo_O3_series = reduce_models(model_band_series, [model_job(model, "tropo") for model in models],
+                                          latitude_ranges=latitude_ranges_tropo_O3)
+
+    # Months spanned by any of the models, numbered year * 12 + month - 1 so
+    # the 360-day model calendar compares directly with the obs' Gregorian one;
+    # observations are loaded from the first of the earliest month up to (not
+    # including) the first of the month after the latest
+    model_months = model_total_O3_series.period.values
+    earliest_overall_time = period_start(model_months.min())
+    latest_overall_time   = period_start(model_months.max() + 1)
+
+    # Only load observation data that falls within model time bounds
+    # (we know observation data is wider in time), opening only the files that
+    # overlap and reusing a local copy of the subset if we've loaded it before
+    observation_total_O3_cube, observation_total_sigma_cube = load_archive_subset(
+        bodeker_total_O3_wildpath, earliest_overall_time, latest_overall_time,
+        bodeker_total_O3_name, cache_dir=args.cache_dir)
+
+    observation_tropo_O3_cube, _ = load_archive_subset(
+        omi_tropo_O3_path, earliest_overall_time, latest_overall_time,
+        omi_tropo_O3_name, cache_dir=args.cache_dir)
+
     make_plots(args,
                observation_total_O3_cube,
                observation_total_sigma_cube,
-               model_total_O3_cube,
+               model_total_O3_series,
                latitude_ranges_total_O3,
                "Bodeker observation",
                "BodekerScientific_Total_Column_Ozone",
                "bodeker_total")
 
     make_plots(args,
-               observation_tropo_O3_dataset,
+               observation_tropo_O3_cube,
                None,
-               model_tropo_O3_cube,
+               model_tropo_O3_series,
                latitude_ranges_tropo_O3,
                "OMI observation",
                "OMI/MLS_Tropospheric_Column_Ozone",
@@ -115,33 +115,42 @@ def main(args):
 def make_plots(args,
                observation_cube,
                 observation_sigma_cube,
-                model_cube_dict,
+                model_series,
                 latitude_ranges,
                 observation_legend,
                 title_fragment,
                 filename_fragment):
-    """Common code to do set of comparative plots"""
+    """Common code to do set of comparative plots; model_series is the stacked
+    (model, period, band) output of model_band_series"""
 
     y_range=(200,475)
 
-    for lat_min, lat_max in latitude_ranges:
+    # Area-weighted means for every latitude band of the observations up front,
+    # one pass over each time series rather than one per band
+    observation_series = latitude_band_series(observation_cube, latitude_ranges)
+    sigma_series = (latitude_band_series(observation_sigma_cube, latitude_ranges)
+                    if observation_sigma_cube else None)
+
+    for band, (lat_min, lat_max) in enumerate(latitude_ranges):
         # Compare global means over the time we have
         # Observations first
-        observation_total_by_time = global_average_over_time(observation_cube, lat_min, lat_max)
+        observation_total_by_time = observation_series[band]
         iris.quickplot.plot(observation_total_by_time, label=observation_legend, color="blue")
 
-        if observation_sigma_cube:
+        if sigma_series:
             # Error bars...
             # Iris coord points for time give tuples, el[0]=value, el[1]=bounds...
             iris_time_points = observation_total_by_time.coord("time").cells()
             standard_time_points = [datetime.datetime(point[0].year, point[0].month, point[0].day) for point in iris_time_points]
-            sigma_average_over_time = global_average_over_time(observation_sigma_cube, lat_min, lat_max)
+            sigma_average_over_time = sigma_series[band]
             plt.errorbar(standard_time_points, observation_total_by_time.data, yerr=sigma_average_over_time.data)
 
-        for model, model_cube in model_cube_dict.items():
-            model_total_by_time = global_average_over_time(model_cube, lat_min, lat_max)
-            iris.quickplot.plot(model_total_by_time, label=model,
-                                color="darkblue" if model == "UKESM-1.1" else "green")
+        for index, model in enumerate(model_series.model.values):
+            # Months missing from this model (but in another) are NaN, so gaps
+            model_total_by_time = model_series.sel(model=model).isel(band=band)
+            model_time_points = [period_start(period).replace(day=15) for period in model_total_by_time.period.values]
+            plt.plot(model_time_points, model_total_by_time.values, label=model,
+                     color=model_colors[index % len(model_colors)])
         plt.title(f"Model vs {title_fragment}, latitude: [{lat_min}, {lat_max}] deg")
         plt.legend()
 
@@ -156,6 +165,29 @@ def make_plots(args,
             plt.clf() # Clear to avoid data stacking up successively on same plot
 
 
+def model_job(model, column):
+    """reduce_models entry for one of a model's column files"""
+
+    job = {key: value for key, value in model.items() if key in ("name", "member")}
+    job["file"] = model[column]
+    return job
+
+
+def model_band_series(subpath, latitude_ranges):
+    """Area-weighted latitude band means of a model's column ozone, as a
+    (period, band) DataArray indexed by monthly_period_index so that runs on
+    different calendars stack month by month; run in a worker by reduce_models"""
+
+    cube = load_model_O3_cube(subpath)
+    series = latitude_band_series(cube, latitude_ranges)
+    data = np.ma.stack([band_cube.data for band_cube in series], axis=1)
+    return xr.DataArray(np.ma.filled(data.astype(float), np.nan),
+                        dims=("period", "band"),
+                        coords={"period": monthly_period_index(cube.coord("time"))},
+                        name=cube.name(),
+                        attrs={"units": str(cube.units)})
+
+
 def load_model_O3_cube(subpath):
     """Load model output cube from within that folder"""
 
@@ -168,35 +200,76 @@ def load_model_O3_cube(subpath):
     return model_total_O3_cube
 
 
-def global_average_over_time(whole_cube, lat_min, lat_max):
-    """Average grand total ozone between latitude limits
-    to give timeseries"""
+# Normalised (band, latitude, longitude) weight matrices, keyed by grid and bands
+band_weights_cache = {}
 
-    model_lat_constraint = iris.Constraint(latitude=lambda cell: lat_min <= cell.point <= lat_max)
-    cube = whole_cube.extract(model_lat_constraint)
-    if isinstance(cube, iris.cube.CubeList):
-        # For some reason OMI data is list at this point
-        cube = cube[0]
 
-    # Weighting by cell areas so that small polar cells don't have undue
-    # influence on average
-    collapse_coords = ['latitude', 'longitude']
+def latitude_band_weights(cube, latitude_ranges):
+    """Area weights of shape (band, latitude, longitude), each band summing to one,
+    built once per grid and set of latitude ranges"""
 
-    for coord_name in collapse_coords:
+    latitude = cube.coord("latitude")
+    longitude = cube.coord("longitude")
+    key = (latitude.points.tobytes(), longitude.points.tobytes(), tuple(latitude_ranges))
+    if key in band_weights_cache:
+        return band_weights_cache[key]
+
+    # Weighting by cell areas so that small polar cells don't have undue
+    # influence on average; only one horizontal slice is needed for that
+    grid_cube = next(cube.slices(["latitude", "longitude"])).copy()
+    for coord_name in ["latitude", "longitude"]:
         # Need bounds to do area weights
-        coord = cube.coord(coord_name)
+        coord = grid_cube.coord(coord_name)
         if not coord.has_bounds():
             coord.guess_bounds()
         # OMI lacks units here
         if str(coord.units).lower() == "unknown":
             coord.units = "degrees"
+    cell_areas_m2 = iris.analysis.cartography.area_weights(grid_cube)
+    if grid_cube.coord_dims("latitude")[0] > grid_cube.coord_dims("longitude")[0]:
+        cell_areas_m2 = cell_areas_m2.T
 
-    cell_areas_m2 = iris.analysis.cartography.area_weights(cube)
+    weights = np.zeros((len(latitude_ranges),) + cell_areas_m2.shape)
+    for band, (lat_min, lat_max) in enumerate(latitude_ranges):
+        in_band = (latitude.points >= lat_min) & (latitude.points <= lat_max)
+        weights[band, in_band, :] = cell_areas_m2[in_band, :]
+    weights /= weights.sum(axis=(1, 2), keepdims=True)
+
+    band_weights_cache[key] = weights
+    return weights
+
+
+def latitude_band_series(cube, latitude_ranges):
+    """Area-weighted average between each pair of latitude limits, as a list of
+    timeseries cubes, from a single tensordot over the whole time series"""
+
+    if isinstance(cube, iris.cube.CubeList):
+        # For some reason OMI data is list at this point
+        cube = cube[0]
 
-    collapsed = cube.collapsed(collapse_coords,
-                                iris.analysis.MEAN,
-                                weights=cell_areas_m2)
-    return collapsed
+    weights = latitude_band_weights(cube, latitude_ranges)
+    lat_dim = cube.coord_dims("latitude")[0]
+    lon_dim = cube.coord_dims("longitude")[0]
+    time_dim = [dim for dim in range(cube.ndim) if dim not in (lat_dim, lon_dim)][0]
+    data = np.ma.masked_invalid(np.ma.asarray(cube.data)).transpose(time_dim, lat_dim, lon_dim)
+
+    # (time, latitude, longitude) x (band, latitude, longitude) -> (time, band),
+    # renormalising where cells are missing
+    valid = ~np.ma.getmaskarray(data)
+    weighted_sums = np.tensordot(data.filled(0.0), weights, axes=([1, 2], [1, 2]))
+    weight_sums = np.tensordot(valid.astype(float), weights, axes=([1, 2], [1, 2]))
+    means = np.ma.masked_equal(weight_sums, 0.0)
+    means = weighted_sums / means
+
+    time_coord = cube.coord(dimensions=time_dim, dim_coords=True)
+    series = []
+    for band in range(len(latitude_ranges)):
+        band_cube = iris.cube.Cube(means[:, band],
+                                   dim_coords_and_dims=[(time_coord.copy(), 0)],
+                                   units=cube.units)
+        band_cube.metadata = cube.metadata
+        series.append(band_cube)
+    return series
 
 
 if __name__ == "__main__":
@@ -209,6 +282,9 @@ if __name__ == "__main__":
     parser.add_argument("--interactive",
                         action=argparse.BooleanOptionalAction,
                         default=False)
+    parser.add_argument("--cache-dir",
+                        default="cache",
+                        help="Where to keep the observation time index and subsets")
     
     args = parser.parse_args()
 
@@ -0,0 +1,133 @@
+"""Time-windowed loading of observation archives split over many NetCDF
+files (e.g. one Bodeker file per year), with a local cache.
+
+The time range of every file is indexed once from its time coordinate alone
+(and only re-read when a file changes), so a request only opens the files
+that overlap the window. The merged subset is saved locally, so repeat
+comparisons over the same window don't go back to the archive at all.
+
+Charlie Wartnaby cew12@cam.ac.uk
+"""
+
+import glob
+import hashlib
+import json
+import os
+
+import cftime
+import iris
+import iris.cube
+import netCDF4
+
+
+def load_archive_subset(wildpath, start, end, value_name, cache_dir="cache"):
+    """Load cubes from the files matching wildpath with start <= time < end,
+    returning (value cube, uncertainty cube or None).
+
+    start and end are anything with year/month/day attributes (datetimes or
+    cftime dates of any calendar). Cubes are split by name rather than by
+    position: value_name (var_name or name()) selects the values and the one
+    other variable, if any, is taken as their uncertainty."""
+
+    start_key, end_key = date_key(start), date_key(end)
+    index = update_time_index(sorted(glob.glob(wildpath)), cache_dir)
+    paths = [path for path, entry in index.items()
+             if tuple(entry["start"]) < end_key and tuple(entry["end"]) >= start_key]
+    if not paths:
+        raise ValueError(f"No files matching {wildpath} overlap {start_key} to {end_key}")
+
+    subset_key = hashlib.sha1(json.dumps([[(path, index[path]["mtime"], index[path]["size"]) for path in paths],
+                                          start_key, end_key, value_name]).encode()).hexdigest()[:16]
+    subset_path = os.path.join(cache_dir, "obs_subsets", f"{subset_key}.nc")
+    if os.path.exists(subset_path):
+        print(f"Using cached observation subset {subset_path}")
+        return split_value_and_uncertainty(iris.load(subset_path), value_name)
+
+    print(f"Loading {len(paths)} of {len(index)} file(s) matching {wildpath}")
+    cubes = iris.cube.CubeList()
+    for cube in iris.load(paths):
+        time_coord = cube.coord(axis="T")
+        window = iris.Constraint(coord_values={
+            time_coord.name(): lambda cell: start_key <= date_key(cell.point) < end_key})
+        cube = cube.extract(window)
+        if cube is not None:
+            # Iris seems unnecessarily strict but won't merge/concat cubes with different
+            # 'created' timestamp strings, so getting rid of those:
+            cube.attributes.pop("created", None)
+            cubes.append(cube)
+
+    value_cube, sigma_cube = split_value_and_uncertainty(cubes, value_name)
+    os.makedirs(os.path.dirname(subset_path), exist_ok=True)
+    iris.save([cube for cube in (value_cube, sigma_cube) if cube is not None], subset_path)
+    return value_cube, sigma_cube
+
+
+def split_value_and_uncertainty(cubes, value_name):
+    """Concatenate cubes per variable and pick out values and (optional) uncertainty"""
+
+    by_name = {}
+    for cube in cubes:
+        by_name.setdefault(cube.var_name or cube.name(), iris.cube.CubeList()).append(cube)
+    by_name = {name: name_cubes.concatenate_cube() for name, name_cubes in by_name.items()}
+
+    # name() prefers standard_name, so also check long_name (e.g. Bodeker's "Total column ozone")
+    value_key = [name for name, cube in by_name.items()
+                 if value_name in (name, cube.name(), cube.long_name, cube.standard_name)]
+    if len(value_key) != 1:
+        raise ValueError(f"Expected one variable named '{value_name}', found {list(by_name)}")
+    value_cube = by_name.pop(value_key[0])
+    if len(by_name) > 1:
+        raise ValueError(f"Can't tell which of {list(by_name)} is the uncertainty of '{value_name}'")
+    sigma_cube = next(iter(by_name.values()), None)
+    return value_cube, sigma_cube
+
+
+def update_time_index(paths, cache_dir="cache"):
+    """{path: {mtime, size, start, end}} for each file, start/end as
+    (year, month, day, hour) lists; entries are cached and only rebuilt for
+    new or modified files"""
+
+    index_path = os.path.join(cache_dir, "obs_time_index.json")
+    cached = {}
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            cached = json.load(f)
+
+    index = {}
+    changed = False
+    for path in paths:
+        stat = os.stat(path)
+        entry = cached.get(path)
+        if not entry or entry["mtime"] != stat.st_mtime_ns or entry["size"] != stat.st_size:
+            start, end = file_time_range(path)
+            entry = {"mtime": stat.st_mtime_ns, "size": stat.st_size, "start": start, "end": end}
+            changed = True
+        index[path] = entry
+
+    if changed:
+        cached.update(index)
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(index_path, "w") as f:
+            json.dump(cached, f)
+    return index
+
+
+def file_time_range(path):
+    """First and last time in a file as (year, month, day, hour) lists, read
+    from the time coordinate variable only"""
+
+    with netCDF4.Dataset(path) as ds:
+        for name, var in ds.variables.items():
+            units = getattr(var, "units", "")
+            if var.dimensions == (name,) and " since " in units:
+                times = var[:]
+                calendar = getattr(var, "calendar", "standard")
+                first, last = cftime.num2date([times.min(), times.max()], units, calendar)
+                return list(date_key(first)), list(date_key(last))
+    raise ValueError(f"No time coordinate found in {path}")
+
+
+def date_key(date):
+    """Calendar-independent sortable key for a date"""
+
+    return (date.year, date.month, date.day, getattr(date, "hour", 0))
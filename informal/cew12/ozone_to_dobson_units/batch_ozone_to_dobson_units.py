@@ -0,0 +1,147 @@
+#!/bin/env python
+
+"""Batch version of ozone_to_dobson_units.py: converts many model output files
+to total and troposphere-only ozone columns in Dobson Units, in parallel.
+
+Each input is read once to produce both columns, cell areas are reused for
+files on the same grid, and inputs whose outputs are already newer than them
+are skipped.
+
+Example:
+   ./batch_ozone_to_dobson_units.py "/gws/.../u-dr061/2005_2014_O3/*_upm.nc" \\
+                                    "/gws/.../u-dr226/2005_2014_O3/*_upm.nc"
+"""
+
+import argparse
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import iris
+
+from ozone_to_dobson_units import (get_cube_by_longname_fragment, integrate_columns,
+                                   DU_PER_KG_M2_O3)
+
+
+def main(args):
+    """Main entry point"""
+
+    inputs = expand_inputs(args.inputs, args.manifest)
+    jobs = []
+    for input_file in inputs:
+        outputs = output_paths(input_file, args)
+        if not args.force and is_up_to_date(input_file, outputs.values()):
+            print(f"Skipping up-to-date {input_file}")
+            continue
+        jobs.append((input_file, outputs))
+
+    print(f"Converting {len(jobs)} of {len(inputs)} file(s)")
+    failures = 0
+    with ProcessPoolExecutor(max_workers=args.processes) as pool:
+        futures = {pool.submit(convert_file, input_file, outputs, args.time_block): input_file
+                   for input_file, outputs in jobs}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                print(f"Done {futures[future]}")
+            except Exception as e:
+                failures += 1
+                print(f"Failed {futures[future]}: {e}")
+
+    print("All done" if not failures else f"{failures} file(s) failed")
+    return 1 if failures else 0
+
+
+def expand_inputs(patterns, manifest):
+    """Input files from glob patterns plus an optional manifest of one path per line"""
+
+    patterns = list(patterns)
+    if manifest:
+        with open(manifest) as f:
+            patterns += [line.strip() for line in f
+                         if line.strip() and not line.lstrip().startswith("#")]
+    inputs = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            raise FileNotFoundError(f"No files match '{pattern}'")
+        inputs += [path for path in matches if path not in inputs]
+    return inputs
+
+
+def output_paths(input_file, args):
+    """Total and tropo output paths for an input file"""
+
+    stem = os.path.splitext(os.path.basename(input_file))[0]
+    if args.strip_suffix and stem.endswith(args.strip_suffix):
+        stem = stem[:-len(args.strip_suffix)]
+    output_dir = args.output_dir or os.path.dirname(input_file)
+    return {kind: os.path.join(output_dir, args.output_template.format(stem=stem, kind=kind))
+            for kind in ("total", "tropo")}
+
+
+def is_up_to_date(input_file, output_files):
+    """True if every output exists and is newer than the input"""
+
+    input_mtime = os.path.getmtime(input_file)
+    return all(os.path.exists(path) and os.path.getmtime(path) >= input_mtime
+               for path in output_files)
+
+
+def convert_file(input_file, outputs, time_block):
+    """Write total and tropo DU columns for one file, from a single read of it"""
+
+    cubelist = iris.load(input_file)
+    air_mass_cube_kg_cell = get_cube_by_longname_fragment(cubelist, "AIR MASS DIAGNOSTIC (WHOLE")
+    O3_MMR_cube_proportion = get_cube_by_longname_fragment(cubelist, "O3 MASS MIXING RATIO", at_start=True)
+    tropo_mask_cube = get_cube_by_longname_fragment(cubelist, "TROPOSPHERIC MASK")
+
+    columns = integrate_columns(O3_MMR_cube_proportion,
+                                air_mass_cube_kg_cell,
+                                {"total": None, "tropo": tropo_mask_cube},
+                                factor=DU_PER_KG_M2_O3,
+                                time_block=time_block)
+    long_names = {"total": "Total ozone column", "tropo": "Troposphere-only ozone column"}
+    for kind, column_cube in columns.items():
+        column_cube.units = "DU"
+        column_cube.long_name = long_names[kind]
+        os.makedirs(os.path.dirname(outputs[kind]) or ".", exist_ok=True)
+        iris.save(column_cube, outputs[kind])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog="batch_ozone_to_dobson_units.py",
+                    description="Converts many files of O3 mass mixing ratio to total and tropo-only DU columns")
+
+    parser.add_argument("inputs",
+                        nargs="*",
+                        help="Input files or glob patterns")
+    parser.add_argument("-m", "--manifest",
+                        help="Text file listing further inputs (paths or globs), one per line")
+    parser.add_argument("-d", "--output-dir",
+                        help="Directory for outputs (default: alongside each input)")
+    parser.add_argument("--output-template",
+                        default="{stem}_O3_{kind}_DU.nc",
+                        help="Output file name; {kind} is 'total' or 'tropo'")
+    parser.add_argument("--strip-suffix",
+                        default="_upm",
+                        help="Suffix removed from the input name to make {stem}")
+    parser.add_argument("-j", "--processes",
+                        type=int,
+                        default=None,
+                        help="Worker processes (default: one per core)")
+    parser.add_argument("--time-block",
+                        type=int,
+                        default=1,
+                        help="Number of time steps to integrate at once (bounds peak memory)")
+    parser.add_argument("--force",
+                        action=argparse.BooleanOptionalAction,
+                        default=False,
+                        help="Convert even if outputs are up to date")
+
+    args = parser.parse_args()
+    if not args.inputs and not args.manifest:
+        parser.error("give input files/globs and/or --manifest")
+
+    raise SystemExit(main(args))
@@ -0,0 +1,89 @@
+"""Unit conversions for vertically integrated tracer columns.
+
+Columns are integrated once as mass per unit area (kg/m2) or mass per grid
+cell (kg); every supported output unit is then a single scale factor on one
+of those, keyed by the species' molar mass. A tracer is available once its
+molar mass is in informal/vs480/stash_fields.csv.
+"""
+
+import csv
+import os
+
+# Molar masses of UKCA tracers, g/mol, by name, from the STASH table that also
+# names the fields (informal/vs480/stash_fields.csv), so there is one list to keep up to date
+STASH_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "vs480", "stash_fields.csv")
+
+
+def load_molar_masses(path=STASH_TABLE):
+    """Tracer name -> molar mass in g/mol, from the "name" rows of the STASH table"""
+
+    with open(path, newline="") as f:
+        return {row["value"]: float(row["molar_mass_g_mol"]) for row in csv.DictReader(f)
+                if row["attribute"] == "name" and row["molar_mass_g_mol"]}
+
+
+MOLAR_MASS_G_MOL = load_molar_masses()
+
+# Names used in output long names, otherwise the species name is used
+SPECIES_LONG_NAMES = {"O3": "ozone"}
+
+# Convert from mass to a volume at standard temperature and pressure.
+# Now on the one hand https://en.wikipedia.org/wiki/Dobson_unit links to:
+# https://en.wikipedia.org/wiki/Standard_temperature_and_pressure
+# "Since 1982, STP has been defined as a temperature of 273.15 K 
+#  (0 °C, 32 °F) and an absolute pressure of exactly 1 bar (100 kPa, 10^5 Pa)."
+# However, further down the page, and in other places including this NERC
+# definition, 1 atm == 101.325 kPa is used:
+# https://vocab.nerc.ac.uk/collection/P07/current/CFSN0619/
+# ""stp" means standard temperature (0 degC) and pressure (101325 Pa)"
+standard_T_K = 273.15
+standard_p_Pa = 101325.0
+molar_gas_const_J_K_mol = 8.314
+avogadro_per_mol = 6.02214076e23
+
+# Output units: name usable in file names -> units string for the output cube
+COLUMN_UNITS = {
+    "DU": "DU",
+    "molec_cm2": "cm-2",
+    "kg_m2": "kg m-2",
+    "Tg": "Tg",
+}
+
+
+def column_conversion(species, units):
+    """(factor, per_area) to get a column of species in units: multiply the
+    vertically summed mass in kg by factor, after dividing by the cell area
+    in m2 if per_area is True"""
+
+    if species not in MOLAR_MASS_G_MOL:
+        raise ValueError(f"No molar mass known for '{species}'")
+    molar_mass_kg_mol = MOLAR_MASS_G_MOL[species] * 1e-3
+
+    if units == "DU":
+        # pV = nRT           where n = num mols
+        #  n = m / M         where m = atual mass, M = relative molar mass
+        # --> V = ((m/M) RT) / p   
+        # So from the mass per unit area we get the 'volume per unit area' which has
+        # dimensions of length, i.e. the equivalent thickness of the pure gas in the
+        # column compressed to standard T & p. Dobson Units are just that expressed
+        # in units of 10 um (or 1e5 metres). For O3 we should get values of about 300
+        # (i.e. 3 mm or 0.003 m) according to:
+        # https://en.wikipedia.org/wiki/Dobson_unit
+        return (molar_gas_const_J_K_mol * standard_T_K
+                / (molar_mass_kg_mol * standard_p_Pa)) * 1e5, True
+    if units == "molec_cm2":
+        # mols per m2 x Avogadro, then per cm2
+        return avogadro_per_mol / molar_mass_kg_mol * 1e-4, True
+    if units == "kg_m2":
+        return 1.0, True
+    if units == "Tg":
+        # Mass in each grid column, so summing over the grid gives the burden
+        return 1e-9, False
+    raise ValueError(f"Unknown column units '{units}', expected one of {list(COLUMN_UNITS)}")
+
+
+def column_long_name(species, tropo_only):
+    """Long name for an output column, e.g. 'Troposphere-only ozone column'"""
+
+    name = SPECIES_LONG_NAMES.get(species, species)
+    return f"Troposphere-only {name} column" if tropo_only else f"Total {name} column"
@@ -2,7 +2,7 @@
 
 """Utility to convert ozone units in NetCDF file to allow comparison with another
 file. Specifically mass mixing ratio to Dobson Units, intended it to be more
-general but not as yet.
+general but not as yet (but see below).
 
 Created as part of ICCS 2025 summer school hackathon so modified a bit from:
 https://github.com/Centre-for-Atmospheric-Science-Cam-Chem/2025-iccs-hackathon-ukesm
@@ -13,10 +13,22 @@ Charlie Wartnaby cew12@cam.ac.uk
 WARNING: Sophie Turner pointed out the model already has this STASH item:
    50219 Ozone column in Dobson Units
    So summing that would have been a lot simpler. This seems to work fine though.
+
+Now also does other tracers and units (see column_conversions.py), e.g.
+   ./ozone_to_dobson_units.py -i in.nc -s CO -s NO2 -s HCHO -f molec_cm2 -f Tg -o "out_{species}_{units}.nc"
+computes every column from one read of the air mass (and mask) per time block.
 """
 
 import argparse
+import dask
 import iris
+import numpy as np
+
+from column_conversions import COLUMN_UNITS, column_conversion, column_long_name
+
+
+# Kept for callers that only want O3 in DU
+DU_PER_KG_M2_O3 = column_conversion("O3", "DU")[0]
 
 
 def main(args):
@@ -27,76 +39,162 @@ def main(args):
 
     air_mass_cube_kg_cell = get_cube_by_longname_fragment(cubelist, "AIR MASS DIAGNOSTIC (WHOLE")
 
-    O3_MMR_cube_proportion = get_cube_by_longname_fragment(cubelist, "O3 MASS MIXING RATIO")
-        
-    # Build up version of data in new units. Doesn't seem to work using
-    # arithmetic operators directly with cube objects, so going for underlying
-    # data arrays instead. Starting with an alias (so will trash original)
-    O3_mass_cube_kg_cell = O3_MMR_cube_proportion
+    # Matched at the start of the long name, so e.g. NO2 doesn't also pick up HONO2 and HO2NO2
+    mmr_cubes_proportion = {species: get_cube_by_longname_fragment(cubelist, f"{species} MASS MIXING RATIO",
+                                                                   at_start=True)
+                            for species in args.species}
 
+    # Mask out stratosphere if we have been asked to do so
+    tropo_mask_cube = None
     if args.tropo_only:
-        # Mask out stratosphere as we have been asked to do so
         tropo_mask_cube = get_cube_by_longname_fragment(cubelist, "TROPOSPHERIC MASK")
-        O3_mass_cube_kg_cell.data *= tropo_mask_cube.data
-
-    # Convert from mass mixing ratio (unitless) to mass per model cell (kg)
-    O3_mass_cube_kg_cell.data *= air_mass_cube_kg_cell.data
-    
-    # Sum all of the model cells vertically in each longitude/latitude patch
-    collapse_coords=['atmosphere_hybrid_height_coordinate']
-    O3_mass_cube_kg_column = O3_mass_cube_kg_cell.collapsed(collapse_coords,
-                                                            iris.analysis.SUM)
-    
-    # Convert from total mass in cell (which may be of order 100km * 100km)
-    # to mass per unit area
-    cell_areas_m2 = iris.analysis.cartography.area_weights(O3_mass_cube_kg_column)
-    O3_mass_cube_kg_m2 = O3_mass_cube_kg_column / cell_areas_m2
-
-    # Convert from mass to a volume at standard temperature and pressure.
-    # Now on the one hand https://en.wikipedia.org/wiki/Dobson_unit links to:
-    # https://en.wikipedia.org/wiki/Standard_temperature_and_pressure
-    # "Since 1982, STP has been defined as a temperature of 273.15 K 
-    #  (0 °C, 32 °F) and an absolute pressure of exactly 1 bar (100 kPa, 10^5 Pa)."
-    # However, further down the page, and in other places including this NERC
-    # definition, 1 atm == 101.325 kPa is used:
-    # https://vocab.nerc.ac.uk/collection/P07/current/CFSN0619/
-    # ""stp" means standard temperature (0 degC) and pressure (101325 Pa)"
-    standard_T_K = 273.15
-    standard_p_Pa = 101325.0
-    molar_gas_const_J_K_mol = 8.314
-    molar_mass_O3_g_mol = 47.997 # From https://en.wikipedia.org/wiki/Ozone
-    molar_mass_O3_kg_mol = molar_mass_O3_g_mol * 1e-3
-
-    # pV = nRT           where n = num mols
-    #  n = m / M         where m = atual mass, M = relative molar mass
-    # --> V = ((m/M) RT) / p   
-    num_mols_column_per_m2 = O3_mass_cube_kg_m2 / molar_mass_O3_kg_mol
-    volume_column_m3_per_m2 = ((num_mols_column_per_m2 * molar_gas_const_J_K_mol * standard_T_K)
-                                  / standard_p_Pa)
-    
-    # So we have the 'volume per unit area' which has dimensions of length,
-    # i.e. the equivalent thickness of pure O3 in the column compressed to standard T & p
-    # Dobson Units are just that expressed in units of 10 um (or 1e5 metres).
-    # We should get values of about 300 (i.e. 3 mm or 0.003 m) according to:
-    # https://en.wikipedia.org/wiki/Dobson_unit
-    volume_column_DU = volume_column_m3_per_m2 * 1e5
-    volume_column_DU.units = "DU"
-    volume_column_DU.long_name = "Troposphere-only ozone column" if args.tropo_only else "Total ozone column"
-    
 
-    print(f"Writing output to {args.output_file}")
-    iris.save(volume_column_DU, args.output_file)
+    output_files = {(species, units): args.output_file.format(species=species, units=units)
+                    for species in args.species for units in args.format}
+    if len(set(output_files.values())) < len(output_files):
+        raise ValueError("Use {species} and/or {units} in the output file name for several outputs")
+
+    # Mask x mass mixing ratio x air mass per cell, summed vertically, divided by
+    # cell area and scaled to the requested units, in a single pass over each
+    # block of time steps for all species and units together
+    conversions = {species: {units: column_conversion(species, units) for units in args.format}
+                   for species in args.species}
+    columns = integrate_species_columns(mmr_cubes_proportion,
+                                        air_mass_cube_kg_cell,
+                                        {"column": tropo_mask_cube},
+                                        conversions,
+                                        time_block=args.time_block)
+
+    for (species, units), output_file in output_files.items():
+        column_cube = columns[(species, "column", units)]
+        column_cube.units = COLUMN_UNITS[units]
+        column_cube.long_name = column_long_name(species, args.tropo_only)
+        print(f"Writing output to {output_file}")
+        iris.save(column_cube, output_file)
 
     print("All done")
 
 
-def get_cube_by_longname_fragment(cubelist, name_fragment):
+def integrate_column(mmr_cube, air_mass_cube, mask_cube=None, factor=1.0, time_block=1,
+                     vertical_coord="atmosphere_hybrid_height_coordinate"):
+    """Vertical column of mass mixing ratio x air mass (x optional mask) per
+    unit area, multiplied by factor.
+
+    Works from the cubes' lazy data one block of time steps at a time, so only
+    that block of the 4D fields is ever in memory. The inputs are not modified."""
+
+    columns = integrate_columns(mmr_cube, air_mass_cube, {"column": mask_cube},
+                                factor, time_block, vertical_coord)
+    return columns["column"]
+
+
+def integrate_columns(mmr_cube, air_mass_cube, mask_cubes, factor=1.0, time_block=1,
+                      vertical_coord="atmosphere_hybrid_height_coordinate"):
+    """As integrate_column, but for several masks (dict of name -> mask cube,
+    or None for the whole atmosphere) from one read of each block of the MMR
+    and air mass. Returns a dict of name -> column cube."""
+
+    columns = integrate_species_columns({"species": mmr_cube}, air_mass_cube, mask_cubes,
+                                        {"species": {"units": (factor, True)}},
+                                        time_block, vertical_coord)
+    return {mask_name: columns[("species", mask_name, "units")] for mask_name in mask_cubes}
+
+
+def integrate_species_columns(mmr_cubes, air_mass_cube, mask_cubes, conversions, time_block=1,
+                              vertical_coord="atmosphere_hybrid_height_coordinate"):
+    """Vertical columns for several species, masks and units in one pass.
+
+    mmr_cubes is a dict of species -> mass mixing ratio cube, mask_cubes a dict
+    of name -> mask cube (None for the whole atmosphere) and conversions a dict
+    of species -> {units: (factor, per_area)} as from column_conversion().
+    Each block of time steps of the air mass, masks and MMRs is read once and
+    the kg per column reduced once per species and mask; every unit is then a
+    scale factor on that. Returns a dict of (species, mask name, units) -> cube."""
+
+    # Collapsing lazy data only builds the output cubes' metadata
+    first_mmr_cube = next(iter(mmr_cubes.values()))
+    template_cube = first_mmr_cube.collapsed([vertical_coord], iris.analysis.SUM)
+
+    vertical_dim = first_mmr_cube.coord_dims(vertical_coord)[0]
+    time_dims = first_mmr_cube.coord_dims("time") if first_mmr_cube.coords("time", dim_coords=True) else ()
+    if time_dims:
+        time_dim = time_dims[0]
+        num_times = first_mmr_cube.shape[time_dim]
+        column_time_dim = time_dim if time_dim < vertical_dim else time_dim - 1
+        # Area is the same for every time step, so only work it out once
+        cell_areas_m2 = get_cell_areas(template_cube[(slice(None),) * column_time_dim + (0,)])
+        cell_areas_m2 = np.expand_dims(cell_areas_m2, column_time_dim)
+    else:
+        time_dim, num_times, column_time_dim = None, 1, None
+        cell_areas_m2 = get_cell_areas(template_cube)
+
+    mmrs = {species: cube.lazy_data() for species, cube in mmr_cubes.items()}
+    air_mass = air_mass_cube.lazy_data()
+    masks = {name: cube.lazy_data() if cube is not None else None
+             for name, cube in mask_cubes.items()}
+
+    keys = [(species, mask_name) for species in mmrs for mask_name in masks]
+    blocks = {(species, mask_name, units): []
+              for species, mask_name in keys for units in conversions[species]}
+    for start in range(0, num_times, time_block):
+        index = [slice(None)] * air_mass.ndim
+        if time_dim is not None:
+            index[time_dim] = slice(start, start + time_block)
+        index = tuple(index)
+        block_air_mass = air_mass[index]
+        mass_kg_columns = []
+        for species, mask_name in keys:
+            mass_kg_cell = mmrs[species][index] * block_air_mass
+            if masks[mask_name] is not None:
+                mass_kg_cell = mass_kg_cell * masks[mask_name][index]
+            mass_kg_columns.append(mass_kg_cell.sum(axis=vertical_dim))
+        # Computing together means each block of input is only read once
+        mass_kg_columns = dask.compute(*mass_kg_columns)
+        for (species, mask_name), mass_kg_column in zip(keys, mass_kg_columns):
+            mass_kg_m2 = mass_kg_column / cell_areas_m2
+            for units, (factor, per_area) in conversions[species].items():
+                blocks[(species, mask_name, units)].append(
+                    (mass_kg_m2 if per_area else mass_kg_column) * factor)
+
+    columns = {}
+    for key, key_blocks in blocks.items():
+        column_cube = template_cube.copy()
+        if column_time_dim is None:
+            column_cube.data = key_blocks[0]
+        else:
+            column_cube.data = np.ma.concatenate(key_blocks, axis=column_time_dim)
+        columns[key] = column_cube
+    return columns
+
+
+# Cell areas keyed by horizontal grid, kept for the life of the process so
+# repeated files on the same grid don't recompute them
+cell_areas_cache = {}
+
+
+def get_cell_areas(cube):
+    """Area weights (m2) for a 2D latitude/longitude cube, cached per grid"""
+
+    key = []
+    for coord_name in ("latitude", "longitude"):
+        coord = cube.coord(coord_name)
+        key.append(coord.points.tobytes())
+        key.append(coord.bounds.tobytes() if coord.has_bounds() else b"")
+    key = tuple(key)
+    if key not in cell_areas_cache:
+        cell_areas_cache[key] = iris.analysis.cartography.area_weights(cube)
+    return cell_areas_cache[key]
+
+
+def get_cube_by_longname_fragment(cubelist, name_fragment, at_start=False):
     """Find the one and only cube in the list whose long name contains the provided
-    fragment, else error"""
+    fragment (or starts with it, if at_start), else error"""
 
     matching_cubes = []
     for cube in cubelist:
-        if cube.long_name and name_fragment in cube.long_name:
+        if not cube.long_name:
+            continue
+        if cube.long_name.startswith(name_fragment) if at_start else name_fragment in cube.long_name:
             matching_cubes.append(cube)
     if len(matching_cubes) == 0:
         raise ValueError(f"No cubes match '{name_fragment}'")
@@ -110,23 +208,32 @@ def get_cube_by_longname_fragment(cubelist, name_fragment):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
                     prog="ozone_to_dobson_units.py",
-                    description="Converts O3 mass mixing ratio to facilitate comparisons, optionally tropo only")
+                    description="Converts tracer mass mixing ratios (O3 by default) to columns to facilitate comparisons, optionally tropo only")
     
     parser.add_argument("-i", "--input-file",
                         required=True,
                         help="Input file to process")
     parser.add_argument("-o", "--output-file",
                         required=True,
-                        help="Transformed output file")
+                        help="Transformed output file; may use {species} and {units}")
     parser.add_argument("-t", "--tropo-only",
                         action=argparse.BooleanOptionalAction,
                         default=False,
                         help="Apply troposphere-only mask")
-    # No other units yet implemented but:
+    parser.add_argument("--time-block",
+                        type=int,
+                        default=1,
+                        help="Number of time steps to integrate at once (bounds peak memory)")
+    parser.add_argument("-s", "--species",
+                        action="append",
+                        help="Tracer to integrate, may be repeated (default O3)")
     parser.add_argument("-f", "--format",
-                        default="DU",
-                        help="Units to convert to")
+                        action="append",
+                        choices=list(COLUMN_UNITS),
+                        help="Units to convert to, may be repeated (default DU)")
     
     args = parser.parse_args()
+    args.species = args.species or ["O3"]
+    args.format = args.format or ["DU"]
 
     main(args)
@@ -0,0 +1,153 @@
+#!/bin/env python
+
+"""
+Pull just the wanted STASH items out of UM pp output into compact NetCDF4
+(or Zarr), so evaluation scripts don't have to wade through every field.
+
+The STASH codes are turned into an iris load constraint, which iris checks
+against each pp field header before building any cubes, so fields that
+aren't asked for are never read. The cubes are then named with
+STASH_fields_defs.UKCA_callback and written compressed and chunked by time.
+
+e.g.
+    ./stash_ingest.py -i "apm/*.pp" -s m01s34i001 -s TCO -o o3_fields.nc
+    ./stash_ingest.py -i "apm/*.pp" -s O3 -o o3_fields.zarr --format zarr
+"""
+
+import argparse
+import glob
+
+import iris
+import iris.fileformats.netcdf
+
+from STASH_fields_defs import STASH_ROWS, UKCA_callback
+
+
+def resolve_stash_codes(fields, rows=STASH_ROWS):
+    """STASH codes for a list of codes and/or names (or var_names) from stash_fields.csv"""
+
+    codes_by_name = {}
+    for row in rows:
+        codes_by_name.setdefault(row["value"], row["stash"])
+    known_codes = {row["stash"] for row in rows}
+
+    codes = []
+    for field in fields:
+        if field in codes_by_name:
+            code = codes_by_name[field]
+        elif field in known_codes or (len(field) == 10 and field.startswith("m")):
+            code = field
+        else:
+            raise ValueError(f"'{field}' is neither a STASH code nor a name in the STASH table")
+        if code not in codes:
+            codes.append(code)
+    return codes
+
+
+def stash_constraint(codes):
+    """Load constraint matching any of the STASH codes.
+
+    It must be the only constraint given to iris.load for iris to apply it to
+    the pp headers rather than to the cubes after loading."""
+
+    codes = set(codes)
+    return iris.AttributeConstraint(STASH=lambda stash: str(stash) in codes)
+
+
+def load_stash_fields(paths, codes, callback=UKCA_callback):
+    """Cubes for only the given STASH codes from pp (or fieldsfile) paths"""
+
+    cubes = iris.load(paths, stash_constraint(codes), callback=callback)
+    found = {str(cube.attributes.get("STASH")) for cube in cubes}
+    missing = [code for code in codes if code not in found]
+    if missing:
+        print(f"WARNING: no fields found for {missing}")
+    return cubes
+
+
+def cube_chunksizes(cube, time_chunk=1):
+    """NetCDF chunk shape: time_chunk steps of the full field"""
+
+    chunks = list(cube.shape)
+    if cube.coords("time", dim_coords=True):
+        time_dim = cube.coord_dims("time")[0]
+        chunks[time_dim] = min(time_chunk, chunks[time_dim])
+    return tuple(chunks)
+
+
+def save_netcdf(cubes, output_file, complevel=4, time_chunk=1):
+    """Write the cubes to one compressed, chunked NetCDF4 file"""
+
+    with iris.fileformats.netcdf.Saver(output_file, "NETCDF4") as saver:
+        for cube in cubes:
+            saver.write(cube, zlib=True, complevel=complevel,
+                        chunksizes=cube_chunksizes(cube, time_chunk))
+
+
+def save_zarr(cubes, output_store, complevel=4, time_chunk=1):
+    """Write the cubes to a Zarr store, going via a temporary NetCDF file as
+    that's the simplest well-trodden route from iris to xarray"""
+
+    import os
+    import tempfile
+    import xarray as xr
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_file = os.path.join(tmp_dir, "fields.nc")
+        save_netcdf(cubes, tmp_file, complevel=complevel, time_chunk=time_chunk)
+        with xr.open_dataset(tmp_file, chunks={}) as ds:
+            ds.to_zarr(output_store, mode="w")
+
+
+def main(args):
+    """Main entry point"""
+
+    paths = sorted(path for pattern in args.input_files for path in glob.glob(pattern))
+    if not paths:
+        raise ValueError(f"No input files match {args.input_files}")
+    codes = resolve_stash_codes(args.stash)
+
+    print(f"Loading {codes} from {len(paths)} files")
+    cubes = load_stash_fields(paths, codes)
+    for cube in cubes:
+        print(f"   {cube.attributes.get('STASH')}: {cube.summary(shorten=True)}")
+
+    print(f"Writing output to {args.output}")
+    if args.format == "zarr":
+        save_zarr(cubes, args.output, complevel=args.complevel, time_chunk=args.time_chunk)
+    else:
+        save_netcdf(cubes, args.output, complevel=args.complevel, time_chunk=args.time_chunk)
+
+    print("All done")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog="stash_ingest.py",
+                    description="Extracts selected STASH items from pp files to compressed NetCDF4 or Zarr")
+
+    parser.add_argument("-i", "--input-files",
+                        required=True,
+                        action="append",
+                        help="Input pp file or glob, may be repeated")
+    parser.add_argument("-s", "--stash",
+                        required=True,
+                        action="append",
+                        help="STASH code (e.g. m01s34i001) or name from stash_fields.csv (e.g. O3), may be repeated")
+    parser.add_argument("-o", "--output",
+                        required=True,
+                        help="Output NetCDF file or Zarr store")
+    parser.add_argument("--format",
+                        choices=["netcdf", "zarr"],
+                        default="netcdf",
+                        help="Output format (zarr needs the zarr package)")
+    parser.add_argument("--complevel",
+                        type=int,
+                        default=4,
+                        help="Compression level 1-9")
+    parser.add_argument("--time-chunk",
+                        type=int,
+                        default=1,
+                        help="Number of time steps per chunk on disk")
+
+    main(parser.parse_args())
@@ -1,9 +1,8 @@
 import yaml
-from utils.data_io import load_model_data, load_station_csv
-from utils.processing import get_nearest_point, filter_stations, mean_bias_error, correlation
-from utils.plot_utils import set_plot_style, plot_station_seasonal
-from matplotlib.backends.backend_pdf import PdfPages
-import matplotlib.pyplot as plt
+from utils.data_io import load_station_csv
+from utils.processing import station_climatology, reduce_models, model_labels
+from utils.stats import compute_stats
+from utils.plot_utils import set_plot_style, station_panels, render_station_pages
 from utils.units import convert
 
 
@@ -12,52 +11,52 @@ with open("config.yaml") as f:
     config = yaml.safe_load(f)
 
 
-ds1 = load_model_data(config['model_file'])
-ds2 = load_model_data(config['model_file'])
-stations = load_station_csv(config['stations_csv'])
 var_name = config['var_name']
 level = config['level']
+chunks = config.get('chunks', None)
 ylim = config.get('ylim', None)
 model_units = config['model_units']
 plot_units = config['plot_units']
-
-# Filter stations to model domain
-lat_min, lat_max = float(ds1.lat.min()), float(ds1.lat.max())
-lon_min, lon_max = float(ds1.lon.min()), float(ds1.lon.max())
-stations = filter_stations(stations, lat_min, lat_max, lon_min, lon_max)
-
-# Build sites dict
-sites = {row["Site Name"]: (row["Latitude"], row["Longitude"]) for _, row in stations.iterrows()}
+cache_dir = config.get('cache_dir', 'cache')
+cache_max_mb = config.get('cache_max_mb', 500)
+stations = load_station_csv(config['stations_csv'])
+stations = stations.drop_duplicates("Site Name")
+
+
+# Every model run / ensemble member to compare; a single model_file if none are listed
+models = config.get('models') or [{'name': 'model', 'file': config['model_file']}]
+labels = model_labels(models)
+
+# Station climatologies are cached, so the model files are only opened on a cache miss
+reduce_kwargs = dict(var_name=var_name, stations=stations, level=level, chunks=chunks,
+                     cache_dir=cache_dir, max_cache_mb=cache_max_mb)
+
+# Obs and every model reduced together in parallel workers, the obs only once,
+# before this process opens any data
+obs_file = config['obs_file']
+if 'obs' in labels:
+    raise ValueError("'obs' is reserved for obs_file; give that model a different name or a member")
+jobs = [{'name': 'obs', 'file': obs_file}] + [m for m in models if m['file'] != obs_file]
+clims = reduce_models(station_climatology, jobs, processes=config.get('processes', None), **reduce_kwargs)
+obs_clim = clims.isel(model=0, drop=True)
+mod_clim = clims.sel(model=[clims.model.values[0] if m['file'] == obs_file else label
+                            for m, label in zip(models, labels)])
+mod_clim = mod_clim.assign_coords(model=labels, run=("model", [m['name'] for m in models]),
+                                  member=("model", [m.get('member') or "" for m in models]))
+stations = stations[stations["Site Name"].isin(obs_clim.station.values)]
+
+# Convert the whole climatologies once, in place
+for clim in (obs_clim, mod_clim):
+    for name in ("mean", "std", "min", "max"):
+        convert(clim[name], model_units, plot_units, inplace=True)
+
+# r and MBE for every station and model in one vectorized call
+stats = compute_stats(obs_clim["mean"], mod_clim["mean"], dim="month")
 
 set_plot_style()
 
-with PdfPages(config['output_pdf']) as pdf:
-    fig, axes = plt.subplots(nrows=6, ncols=3, figsize=(12, 18))
-    axes = axes.flatten()
-
-    for ax, (site, (lat, lon)) in zip(axes, sites.items()):
-        try:
-            obs = get_nearest_point(ds1[var_name].sel(lev=level, method="nearest"), lat, lon)
-            mod = get_nearest_point(ds2[var_name].sel(lev=level, method="nearest"), lat, lon)
-            obs_grp = obs.groupby("time.month")
-            mod_grp = mod.groupby("time.month")
-            obs_mean = obs_grp.mean("time")
-            obs_std  = obs_grp.std("time")
-            mod_mean = mod_grp.mean("time")
-            r   = correlation(obs_mean, mod_mean)
-            mbe = mean_bias_error(obs_mean, mod_mean)
-            obs_mean_plot = convert(obs_mean, model_units, plot_units)
-            obs_std_plot  = convert(obs_std, model_units, plot_units)
-            mod_mean_plot = convert(mod_mean, model_units, plot_units)
-            plot_station_seasonal(ax, obs_mean_plot, obs_std_plot, mod_mean_plot, site, lat, lon, r, mbe, ylim, plot_units=config["plot_units"])
-        except Exception as e:
-            ax.set_title(f"{site} (Error)", fontsize=10, weight="bold")
-            ax.text(0.5, 0.5, str(e), ha="center", va="center", fontsize=8)
-
-    handles, labels = ax.get_legend_handles_labels()
-    fig.legend(handles, labels, loc="upper center", ncol=2, fontsize=10)
-    fig.tight_layout(rect=[0,0,1,0.95])
-    pdf.savefig(fig)
-    plt.close()
-
-print(f"PDF successfully saved as '{config['output_pdf']}'")
+panels = station_panels(stations, obs_clim, mod_clim, stats)
+
+# All stations, split over as many pages as needed and rendered in parallel
+if render_station_pages(panels, config['output_pdf'], ylim, plot_units, processes=config.get('processes', None)):
+    print(f"PDF successfully saved as '{config['output_pdf']}'")
@@ -0,0 +1,60 @@
+import yaml
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
+from utils.data_io import load_model_data, read_emmons_campaigns
+from utils.emmons import campaign_model_stats
+from utils.vertical import model_altitude_km
+from utils.plot_utils import set_plot_style, plot_emmons_profile
+
+
+# Load config
+with open("config.yaml") as f:
+    config = yaml.safe_load(f)
+
+
+emmons_config = config['emmons']
+nrows, ncols = emmons_config.get('nrows', 3), emmons_config.get('ncols', 3)
+
+# Every campaign region's obs profile, as one table
+obs = read_emmons_campaigns(emmons_config['stat_dir'], emmons_config['campaigns_csv'])
+
+# Altitude of each model level in km, from hybrid height and orography, or
+# pressure through the standard atmosphere
+ds = load_model_data(emmons_config['model_file'], chunks=emmons_config.get('chunks', {}))
+lev_dim = emmons_config.get('lev_dim', 'lev')
+orog = None
+if emmons_config.get('orog_file'):
+    orog = load_model_data(emmons_config['orog_file'])[emmons_config.get('orog_var', 'orog')]
+alt_km = model_altitude_km(ds, lev_dim=lev_dim, orog=orog).compute()
+
+# Model stats for every box, month and altitude bin from one read of the model
+# (streamed through quantile sketches time_block steps at a time if set)
+da = ds[emmons_config['var_name']] * float(emmons_config.get('scale', 1.0))
+table = campaign_model_stats(da, obs, alt_km, method=emmons_config.get('vertical', 'bin'),
+                             cache_dir=config.get('cache_dir', 'cache'), lev_dim=lev_dim,
+                             time_block=emmons_config.get('time_block', None))
+if emmons_config.get('output_csv'):
+    table.to_csv(emmons_config['output_csv'], index=False)
+
+set_plot_style()
+
+regions = list(table.groupby(['campaign', 'region'], sort=False))
+per_page = nrows * ncols
+with PdfPages(emmons_config['output_pdf']) as pdf:
+    for start in range(0, len(regions), per_page):
+        fig, axes = plt.subplots(nrows, ncols, figsize=(ncols * 4, nrows * 5), sharey=True)
+        axes = axes.flatten()
+        for ax, ((campaign, region), profile) in zip(axes, regions[start:start + per_page]):
+            row = profile.iloc[0]
+            title = (f"{campaign} {region} (month {row['month']})\n"
+                     f"Lat {row['lat_min']}-{row['lat_max']} Lon {row['lon_min']}-{row['lon_max']}")
+            plot_emmons_profile(ax, profile, title, emmons_config.get('species_label', ''),
+                                emmons_config.get('model_label', 'model'))
+        for ax in axes[len(regions[start:start + per_page]):]:
+            ax.axis('off')
+        axes[0].legend()
+        fig.tight_layout()
+        pdf.savefig(fig)
+        plt.close(fig)
+
+print(f"PDF successfully saved as '{emmons_config['output_pdf']}'")
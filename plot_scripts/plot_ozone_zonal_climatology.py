@@ -0,0 +1,96 @@
+import os
+import yaml
+import dask
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
+from utils.data_io import load_model_data
+from utils.processing import compute_zonal_climatology, climatology_cache_key, cached_dataset, cache_file_path
+from utils.regrid import regrid_conservative
+from utils.plot_utils import set_plot_style, climatology_levels, plot_zonal_climatology_and_bias
+
+
+# Load config
+with open("config.yaml") as f:
+    config = yaml.safe_load(f)
+
+
+zonal_config = config['zonal_climatology']
+datasets = zonal_config['datasets']
+chunks = zonal_config.get('chunks', {})
+units = zonal_config.get('units', 'DU')
+cache_dir = config.get('cache_dir', 'cache')
+cache_max_mb = config.get('cache_max_mb', 500)
+
+
+def lat_dim(name):
+    return datasets[name].get('dims', {}).get('lat', 'latitude')
+
+
+# Climatologies are cached, keyed on the source files' fingerprint, variable and
+# dims, so a re-run that only changes plot settings doesn't read the raw files
+opened = {}
+
+def lazy_climatology(dataset):
+    # Each file is opened once, however many datasets use it
+    if dataset['file'] not in opened:
+        opened[dataset['file']] = load_model_data(dataset['file'], chunks=chunks)
+    return compute_zonal_climatology(opened[dataset['file']][dataset['var_name']], dataset.get('dims'))
+
+def climatology_key(dataset):
+    return climatology_cache_key(dataset['file'], dataset['var_name'], None, "zonal_climatology",
+                                 dims=dataset.get('dims'))
+
+def cached_zonal_climatology(dataset, computed=None):
+    # `computed` is the climatology when it was just computed; otherwise it is read from the
+    # cache (or, should the entry have gone meanwhile, computed on its own)
+    def compute():
+        clim = computed if computed is not None else lazy_climatology(dataset).load()
+        return clim.to_dataset(name="climatology")
+    return cached_dataset(compute, climatology_key(dataset), cache_dir=cache_dir, max_cache_mb=cache_max_mb)["climatology"]
+
+clims = {name: cached_zonal_climatology(dataset) for name, dataset in datasets.items()
+         if os.path.exists(cache_file_path(climatology_key(dataset), cache_dir))}
+
+# The rest are built lazily and computed together, so shared files and chunks are only read once
+missing = [name for name in datasets if name not in clims]
+for name, clim in zip(missing, dask.compute(*(lazy_climatology(datasets[name]) for name in missing))):
+    clims[name] = cached_zonal_climatology(datasets[name], computed=clim)
+
+set_plot_style()
+
+with PdfPages(zonal_config['output_pdf']) as pdf:
+    for comparison in zonal_config['comparisons']:
+        model, obs = comparison['model'], comparison.get('obs')
+        model_clim = clims[model]
+        model_label = datasets[model].get('label', model)
+
+        # Obs climatology conservatively regridded onto the model's latitudes for the difference
+        obs_clim = None
+        if obs is not None:
+            obs_clim = clims[obs]
+            if lat_dim(obs) != lat_dim(model):
+                obs_clim = obs_clim.rename({lat_dim(obs): lat_dim(model)})
+            if not np.array_equal(obs_clim[lat_dim(model)], model_clim[lat_dim(model)]):
+                obs_clim = regrid_conservative(obs_clim, model_clim[lat_dim(model)].values,
+                                               lat_dim=lat_dim(model), cache_dir=cache_dir)
+
+        # Colour levels may be shared with another dataset's plot
+        levels_from = comparison.get('clim_levels_from')
+        clim_levels = climatology_levels(clims[levels_from]) if levels_from is not None else None
+        diff_levels = comparison.get('diff_levels')
+        if diff_levels is not None:
+            diff_levels = np.arange(*diff_levels)
+
+        fig = plot_zonal_climatology_and_bias(
+            model_clim, obs_clim, units,
+            model_title=comparison.get('title', model_label),
+            bias_title=comparison.get('bias_title', f"Bias ({model_label} - {datasets[obs].get('label', obs)})" if obs else ""),
+            clim_levels=clim_levels,
+            diff_levels=diff_levels,
+            lat_dim=lat_dim(model),
+        )
+        pdf.savefig(fig)
+        plt.close(fig)
+
+print(f"PDF successfully saved as '{zonal_config['output_pdf']}'")
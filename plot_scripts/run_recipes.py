@@ -0,0 +1,19 @@
+import sys
+import yaml
+from utils.recipes import build_graph, plan, run_graph
+
+
+# Recipe file from the command line, else recipes.yaml
+recipe_file = sys.argv[1] if len(sys.argv) > 1 else "recipes.yaml"
+with open(recipe_file) as f:
+    recipe = yaml.safe_load(f)
+
+cache_dir = recipe.get('cache_dir', 'cache')
+graph, renders = build_graph(recipe)
+needed = plan(renders, cache_dir)
+cached = sum(1 for node, deps in needed.values() if deps is None)
+print(f"{len(recipe['diagnostics'])} diagnostics: {graph.requested} steps, {len(graph.nodes)} after sharing, "
+      f"{len(needed)} to run ({cached} from cache)")
+
+run_graph(renders, threads=recipe.get('threads'), cache_dir=cache_dir,
+          max_cache_mb=recipe.get('cache_max_mb', 500))
@@ -0,0 +1,23 @@
+import numpy as np
+import xarray as xr
+from utils.data_io import load_station_csv
+from utils.processing import load_station_index, gather_stations
+
+
+def test_numeric_station_names_round_trip_through_cache(tmp_path):
+    csv = tmp_path / "stations.csv"
+    csv.write_text("Site Name,Latitude,Longitude\n0123,10.0,20.0\n456,-30.0,150.0\n789,19.5,-155.6\n")
+    stations = load_station_csv(csv)
+    lat = np.arange(-90.0, 91.0, 10.0)
+    lon = np.arange(-180.0, 180.0, 10.0)
+
+    built = load_station_index(lat, lon, stations, cache_dir=tmp_path / "cache")
+    cached = load_station_index(lat, lon, stations, cache_dir=tmp_path / "cache")
+
+    assert list(built["station"]) == ["0123", "456", "789"]
+    assert cached.equals(built)
+
+    da = xr.DataArray(np.zeros((lat.size, lon.size)), dims=("lat", "lon"), coords={"lat": lat, "lon": lon})
+    at_stations = gather_stations(da, cached)
+    for site in stations["Site Name"]:
+        at_stations.sel(station=site)
@@ -1,8 +1,84 @@
+import glob
+import os
 import xarray as xr
 import pandas as pd
 
-def load_model_data(path):
-    return xr.open_dataset(path)
+def expand_paths(path):
+    """Turn a path, glob pattern or list of either into a sorted list of files."""
+    if isinstance(path, (list, tuple)):
+        return [p for item in path for p in expand_paths(item)]
+    return sorted(glob.glob(path)) or [path]
+
+def load_model_data(path, chunks=None, level=None, lev_dim="lev", parallel=True):
+    """Open model output, dask-backed if `chunks` is given (dict of dim sizes or "auto").
+
+    `path` may be a single file, a glob or a list; several files (e.g. 50-year
+    CMIP chunks) are opened in parallel and lazily concatenated along time
+    without re-checking the coordinates they share.
+
+    If `level` is given the nearest level is selected straight away, so only that
+    level is ever read from disk.
+    """
+    def select_level(ds):
+        if level is not None:
+            ds = ds.sel({lev_dim: level}, method="nearest")
+        return ds
+
+    paths = expand_paths(path)
+    if len(paths) == 1:
+        return select_level(xr.open_dataset(paths[0], chunks=chunks))
+    return xr.open_mfdataset(
+        paths,
+        chunks=chunks if chunks is not None else {},
+        combine="nested",
+        concat_dim="time",
+        data_vars="minimal",
+        coords="minimal",
+        compat="override",
+        join="override",
+        parallel=parallel,
+        preprocess=select_level,
+    )
 
 def load_station_csv(path):
-    return pd.read_csv(path)
+    """Station table; "Site Name" is always read as strings, so numeric-looking codes stay labels."""
+    return pd.read_csv(path, dtype={"Site Name": str})
+
+# Columns of an Emmons et al. aircraft campaign .stat file, one row per altitude bin (km)
+EMMONS_STAT_COLUMNS = ["alt", "alt_min", "alt_max", "npts", "mean", "stddev", "median", "p25", "p75"]
+
+def read_emmons_stat_file(path):
+    """Read one Emmons .stat (whitespace, '#' comments) or .csv (one header line) file.
+
+    Returns a DataFrame with the EMMONS_STAT_COLUMNS, one row per altitude bin;
+    any header or text lines are skipped.
+    """
+    if str(path).endswith(".csv"):
+        table = pd.read_csv(path, header=None, skiprows=1)
+    else:
+        table = pd.read_csv(path, sep=r"\s+", comment="#", header=None)
+    table = table.iloc[:, :len(EMMONS_STAT_COLUMNS)]
+    table.columns = EMMONS_STAT_COLUMNS[:table.shape[1]]
+    table = table.apply(pd.to_numeric, errors="coerce").dropna(subset=["alt"])
+    return table.reset_index(drop=True)
+
+def match_stat_files_by_basename(model_dir, obs_dir, suffix_model, suffix_obs):
+    """Sorted lists of model and obs files in the two directories that share a basename before their suffixes."""
+    model = {os.path.basename(p)[:-len(suffix_model)]: p for p in glob.glob(os.path.join(model_dir, "*" + suffix_model))}
+    obs = {os.path.basename(p)[:-len(suffix_obs)]: p for p in glob.glob(os.path.join(obs_dir, "*" + suffix_obs))}
+    common = sorted(model.keys() & obs.keys())
+    return [model[name] for name in common], [obs[name] for name in common]
+
+def read_emmons_campaigns(stat_dir, campaigns_csv):
+    """Every campaign .stat file listed in `campaigns_csv`, as one long table.
+
+    `campaigns_csv` has one row per campaign region: campaign, region, month,
+    lat_min, lat_max, lon_min, lon_max and file (relative to `stat_dir`). The
+    result has those columns plus the EMMONS_STAT_COLUMNS, one row per
+    campaign region and altitude bin.
+    """
+    campaigns = pd.read_csv(campaigns_csv)
+    tables = [read_emmons_stat_file(os.path.join(stat_dir, row["file"])).assign(**row.to_dict())
+              for _, row in campaigns.iterrows()]
+    table = pd.concat(tables, ignore_index=True)
+    return table[list(campaigns.columns) + [c for c in EMMONS_STAT_COLUMNS if c in table.columns]]
@@ -0,0 +1,154 @@
+import warnings
+import numpy as np
+import xarray as xr
+from utils.processing import domain_mask, QuantileSketch
+from utils.vertical import bin_membership, load_interp_weights, apply_interp_weights
+
+QUANTILE_NAMES = {0.25: "model_p25", 0.5: "model_median", 0.75: "model_p75"}
+
+def box_indices(lat, lon, campaigns):
+    """Padded grid indices of every campaign box, computed once from the coordinates.
+
+    Returns (lat_index, lat_valid, lon_index, lon_valid): integer arrays of shape
+    (n_box, widest box) with the padding masked by the valid arrays. Longitudes
+    may use either convention and boxes may cross the dateline (as domain_mask).
+    """
+    lat, lon = np.asarray(lat), np.asarray(lon)
+    lat_rows = [np.flatnonzero((lat >= row.lat_min) & (lat <= row.lat_max)) for row in campaigns.itertuples()]
+    lon_rows = [np.flatnonzero(domain_mask(np.zeros_like(lon), lon, -90, 90, row.lon_min, row.lon_max))
+                for row in campaigns.itertuples()]
+    return _pad(lat_rows) + _pad(lon_rows)
+
+def month_indices(months, campaigns):
+    """Padded time positions of each campaign's month (as `box_indices`), from the model's month numbers."""
+    months = np.asarray(months)
+    return _pad([np.flatnonzero(months == row.month) for row in campaigns.itertuples()])
+
+def _pad(rows):
+    width = max(1, max(len(r) for r in rows))
+    index = np.zeros((len(rows), width), dtype=int)
+    valid = np.zeros((len(rows), width), dtype=bool)
+    for i, r in enumerate(rows):
+        index[i, :len(r)] = r
+        valid[i, :len(r)] = True
+    return index, valid
+
+def extract_campaign_boxes(da, campaigns, alt_km, bins, method="bin", cache_dir="cache",
+                           time_dim="time", lev_dim="lev", lat_dim="lat", lon_dim="lon"):
+    """Model values in every campaign box, month and altitude bin from one gather.
+
+    `da` is (time, lev, lat, lon) in any order, lazily loaded or not, and
+    `alt_km` the altitude of its levels, either 1D or (lev, lat, lon) as from
+    vertical.model_altitude_km. With method "bin" the samples for a bin are the
+    levels inside it; with "interp" they are the profiles interpolated to the
+    bin's mid-point, with weights cached per grid. Returns an array of shape
+    (n_box, n_bin, samples) with NaN padding, the samples covering every time
+    step in the campaign's month and grid cell in its box.
+    """
+    lat_index, lat_valid, lon_index, lon_valid = box_indices(da[lat_dim].values, da[lon_dim].values, campaigns)
+    time_index, time_valid = month_indices(da[time_dim].dt.month.values, campaigns)
+
+    # Vectorised indexing pulls (box, t, y, x, level) in one read of the boxes'
+    # rows and columns, rather than re-opening the file per campaign
+    indexers = {
+        time_dim: xr.DataArray(time_index, dims=("box", "t")),
+        lat_dim: xr.DataArray(lat_index, dims=("box", "y")),
+        lon_dim: xr.DataArray(lon_index, dims=("box", "x")),
+    }
+    values = da.isel(indexers).transpose("box", "t", "y", "x", lev_dim).values.astype(float)
+    valid = time_valid[:, :, None, None] & lat_valid[:, None, :, None] & lon_valid[:, None, None, :]
+
+    if isinstance(alt_km, xr.DataArray) and alt_km.ndim > 1:
+        alt_km = alt_km.transpose(lev_dim, lat_dim, lon_dim)
+    alt_km = np.asarray(alt_km, dtype=float)
+
+    if method == "bin":
+        if alt_km.ndim == 1:
+            member = bin_membership(alt_km, bins)[None, :, None, None, None, :]
+        else:
+            # Level altitudes of each box's columns, (box, y, x, level)
+            box_alt = np.moveaxis(alt_km[:, lat_index[:, :, None], lon_index[:, None, :]], 0, -1)
+            member = np.moveaxis(bin_membership(box_alt, bins, lev_axis=3), 0, 1)[:, :, None]
+        samples = np.where(valid[:, None, :, :, :, None] & member, values[:, None], np.nan)
+    elif method == "interp":
+        mid_km = [(lo + hi) / 2 for lo, hi in bins]
+        index, frac = load_interp_weights(alt_km, mid_km, cache_dir=cache_dir)
+        if alt_km.ndim == 1:
+            profiles = np.moveaxis(apply_interp_weights(values, index, frac, lev_axis=4), 4, 1)
+        else:
+            box_index = index[:, lat_index[:, :, None], lon_index[:, None, :]]
+            box_frac = frac[:, lat_index[:, :, None], lon_index[:, None, :]]
+            # (t, level, box, y, x) so the levels sit in front of the box columns
+            profiles = apply_interp_weights(values.transpose(1, 4, 0, 2, 3), box_index, box_frac, lev_axis=1)
+            profiles = profiles.transpose(2, 1, 0, 3, 4)
+        samples = np.where(valid[:, None], profiles, np.nan)
+    else:
+        raise ValueError(f"Unknown vertical method '{method}', expected 'bin' or 'interp'")
+    return samples.reshape(samples.shape[0], samples.shape[1], -1)
+
+def campaign_model_sketches(da, boxes, alt_km, bins, time_block=12, k=200, method="bin", cache_dir="cache",
+                            time_dim="time", **dims):
+    """A QuantileSketch for every campaign box and altitude bin, fed `time_block` time steps at a time.
+
+    Returns an (n_box, n_bin) object array of sketches. Only one block of the
+    boxes is in memory at once, and sketches from other files or workers (same
+    boxes and bins) can be folded in with `merge`.
+    """
+    sketches = np.empty((len(boxes), len(bins)), dtype=object)
+    for index in np.ndindex(sketches.shape):
+        sketches[index] = QuantileSketch(k=k)
+    for start in range(0, da.sizes[time_dim], time_block):
+        block = da.isel({time_dim: slice(start, start + time_block)})
+        samples = extract_campaign_boxes(block, boxes, alt_km, bins, method=method, cache_dir=cache_dir,
+                                         time_dim=time_dim, **dims)
+        for index in np.ndindex(sketches.shape):
+            sketches[index].update(samples[index])
+    return sketches
+
+def campaign_model_stats(da, campaigns, alt_km, quantiles=(0.25, 0.5, 0.75), method="bin", cache_dir="cache",
+                         time_block=None, k=200, **dims):
+    """Model mean, sd, count and quantiles for every campaign box and altitude bin of the obs table.
+
+    `campaigns` is the long table from data_io.read_emmons_campaigns. By
+    default the quantiles for all boxes and bins come from one nanquantile over
+    the gathered samples (see extract_campaign_boxes for `method`), taking the
+    smallest sample at or above each quantile's rank (numpy's "inverted_cdf",
+    no interpolation) as the sketches do. With
+    `time_block` set, for daily or hourly output, the samples are streamed into
+    quantile sketches instead (see campaign_model_sketches and
+    processing.QuantileSketch for the error bound). Returns the obs table with
+    model_mean, model_sd, model_n and model_p25/model_median/model_p75 (for
+    the default quantiles) added.
+    """
+    boxes = campaigns.drop_duplicates(["campaign", "region"]).reset_index(drop=True)
+    bins = sorted(set(zip(campaigns["alt_min"], campaigns["alt_max"])))
+    names = [QUANTILE_NAMES.get(q, f"model_q{q * 100:g}") for q in quantiles]
+
+    if time_block is not None:
+        sketches = campaign_model_sketches(da, boxes, alt_km, bins, time_block=time_block, k=k, method=method,
+                                           cache_dir=cache_dir, **dims)
+        stats = {
+            "model_mean": np.vectorize(lambda s: s.mean if s.count else np.nan, otypes=[float])(sketches),
+            "model_sd": np.vectorize(lambda s: s.std(), otypes=[float])(sketches),
+            "model_n": np.vectorize(lambda s: s.count, otypes=[int])(sketches),
+        }
+        estimates = np.array([[s.quantile(quantiles) for s in row] for row in sketches])
+        stats.update({name: estimates[..., n] for n, name in enumerate(names)})
+    else:
+        samples = extract_campaign_boxes(da, boxes, alt_km, bins, method=method, cache_dir=cache_dir, **dims)
+        # Empty boxes or bins just give NaN
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            stats = {
+                "model_mean": np.nanmean(samples, axis=-1),
+                "model_sd": np.nanstd(samples, axis=-1),
+                "model_n": np.sum(~np.isnan(samples), axis=-1),
+            }
+            # Same quantile definition as QuantileSketch, so time_block doesn't shift the table
+            stats.update(zip(names, np.nanquantile(samples, quantiles, axis=-1, method="inverted_cdf")))
+
+    box_number = {key: i for i, key in enumerate(zip(boxes["campaign"], boxes["region"]))}
+    bin_number = {key: i for i, key in enumerate(bins)}
+    i = np.array([box_number[key] for key in zip(campaigns["campaign"], campaigns["region"])])
+    j = np.array([bin_number[key] for key in zip(campaigns["alt_min"], campaigns["alt_max"])])
+    return campaigns.assign(**{name: values[i, j] for name, values in stats.items()})
@@ -1,4 +1,12 @@
+import os
+import tempfile
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import matplotlib
+import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
 
 def set_plot_style():
     plt.rcParams.update({
@@ -10,10 +18,18 @@ def set_plot_style():
     })
 
 def plot_station_seasonal(ax, obs_mean, obs_std, mod_mean, site, lat, lon, r, mbe, ylim, plot_units):
+    """Obs and model seasonal cycle at one station. For several models, mod_mean, r and mbe
+    are dicts keyed by model label."""
     ew = "W" if lon < 0 else "E"
     ns = "S" if lat < 0 else "N"
     ax.errorbar(range(1, 13), obs_mean, yerr=obs_std, fmt="-ok", mfc="white", capsize=3, label="obs")
-    ax.plot(range(1, 13), mod_mean, "-or", mfc="white", label="model")
+    if isinstance(mod_mean, dict):
+        for label, mean in mod_mean.items():
+            ax.plot(range(1, 13), mean, "-o", mfc="white", markersize=4, label=label)
+        score_text = "\n".join(f"{label}: r = {r[label]:.3f}   MBE = {mbe[label]:.1f}%" for label in mod_mean)
+    else:
+        ax.plot(range(1, 13), mod_mean, "-or", mfc="white", label="model")
+        score_text = f"r = {r:.3f}   MBE = {mbe:.1f}%"
     ax.grid(True, which="both", linestyle="--", linewidth=0.5)
     ax.set_title(f"{site} ({abs(lat):.1f}°{ns}, {abs(lon):.1f}°{ew})", fontsize=10, weight="bold")
     ax.set_xticks([1, 3, 5, 7, 9, 11])
@@ -21,4 +37,168 @@ def plot_station_seasonal(ax, obs_mean, obs_std, mod_mean, site, lat, lon, r, mb
     ax.set_ylabel(f"CO ({plot_units})")
     if ylim is not None:
         ax.set_ylim(ylim)
-    ax.text(0.5, 0.05, f"r = {r:.3f}   MBE = {mbe:.1f}%", transform=ax.transAxes, ha="center", fontsize=9)
+    ax.text(0.5, 0.05, score_text, transform=ax.transAxes, ha="center",
+            fontsize=9 if not isinstance(mod_mean, dict) else 7)
+
+def plot_station_error(ax, site, error):
+    ax.set_title(f"{site} (Error)", fontsize=10, weight="bold")
+    ax.text(0.5, 0.5, str(error), ha="center", va="center", fontsize=8)
+
+def station_page_figure(panels, ylim, plot_units, nrows=6, ncols=3):
+    """One page of station panels; each panel is a dict of plot_station_seasonal arguments,
+    or {"site": ..., "error": ...} for a station that could not be processed."""
+    fig, axes = plt.subplots(nrows=nrows, ncols=ncols, figsize=(4 * ncols, 3 * nrows))
+    axes = axes.flatten()
+    for ax, panel in zip(axes, panels):
+        if "error" in panel:
+            plot_station_error(ax, panel["site"], panel["error"])
+        else:
+            plot_station_seasonal(ax, ylim=ylim, plot_units=plot_units, **panel)
+    for ax in axes[len(panels):]:
+        ax.axis("off")
+
+    handles, labels = axes[0].get_legend_handles_labels()
+    for ax in axes[:len(panels)]:
+        if ax.get_legend_handles_labels()[0]:
+            handles, labels = ax.get_legend_handles_labels()
+            break
+    fig.legend(handles, labels, loc="upper center", ncol=max(1, min(len(labels), 6)), fontsize=10)
+    fig.tight_layout(rect=[0, 0, 1, 0.95])
+    return fig
+
+def station_panels(stations, obs_clim, mod_clim, stats):
+    """plot_station_seasonal arguments for every station, from station climatologies and
+    their compute_stats. A model climatology with a "model" dimension of more than one
+    entry gives one line per model; stations that fail get an error panel."""
+    labels = list(mod_clim["model"].values) if "model" in mod_clim.dims else None
+    panels = []
+    for _, row in stations.iterrows():
+        site, lat, lon = row["Site Name"], row["Latitude"], row["Longitude"]
+        try:
+            obs_mean = obs_clim["mean"].sel(station=site)
+            obs_std  = obs_clim["std"].sel(station=site)
+            mod_mean = mod_clim["mean"].sel(station=site)
+            r   = stats["r"].sel(station=site)
+            mbe = stats["nmb"].sel(station=site)
+            if labels is None or len(labels) == 1:
+                if labels is not None:
+                    mod_mean, r, mbe = (x.squeeze("model") for x in (mod_mean, r, mbe))
+                panels.append(dict(obs_mean=obs_mean.values, obs_std=obs_std.values, mod_mean=mod_mean.values,
+                                   site=site, lat=lat, lon=lon, r=r.item(), mbe=mbe.item()))
+            else:
+                panels.append(dict(obs_mean=obs_mean.values, obs_std=obs_std.values,
+                                   mod_mean=dict(zip(labels, mod_mean.transpose("model", "month").values)),
+                                   site=site, lat=lat, lon=lon,
+                                   r=dict(zip(labels, r.values)), mbe=dict(zip(labels, mbe.values))))
+        except Exception as e:
+            panels.append(dict(site=site, error=str(e)))
+    return panels
+
+def _init_page_worker():
+    matplotlib.use("Agg")
+    set_plot_style()
+
+def _render_station_page(panels, path, ylim, plot_units, nrows, ncols):
+    fig = station_page_figure(panels, ylim, plot_units, nrows, ncols)
+    fig.savefig(path)
+    plt.close(fig)
+
+def render_station_pages(panels, output_pdf, ylim, plot_units, nrows=6, ncols=3, processes=None):
+    """Write every station panel to `output_pdf`, `nrows * ncols` panels per page, in order.
+
+    Pages are drawn in a process pool with the Agg backend and merged with pypdf.
+    If pypdf is not installed, or there is only one page or process, pages are
+    drawn one after another straight into the PDF instead. Returns False, with
+    a warning and no file written, if there are no panels.
+    """
+    if not panels:
+        warnings.warn(f"No station panels to draw (no stations inside the grid?), so '{output_pdf}' was not written")
+        return False
+    per_page = nrows * ncols
+    pages = [panels[i:i + per_page] for i in range(0, len(panels), per_page)]
+    try:
+        from pypdf import PdfWriter
+    except ImportError:
+        PdfWriter = None
+        if processes != 1 and len(pages) > 1:
+            warnings.warn("pypdf is not installed, so station pages are drawn one at a time "
+                          "(pip install pypdf to draw them in parallel)")
+
+    if PdfWriter is None or processes == 1 or len(pages) < 2:
+        with PdfPages(output_pdf) as pdf:
+            for page in pages:
+                fig = station_page_figure(page, ylim, plot_units, nrows, ncols)
+                pdf.savefig(fig)
+                plt.close(fig)
+        return True
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = [os.path.join(tmp_dir, f"page_{i:04d}.pdf") for i in range(len(pages))]
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_page_worker) as pool:
+            list(pool.map(_render_station_page, pages, paths,
+                          repeat(ylim), repeat(plot_units), repeat(nrows), repeat(ncols)))
+        writer = PdfWriter()
+        for path in paths:
+            writer.append(path)
+        writer.write(output_pdf)
+    return True
+
+MONTH_LABELS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+def climatology_levels(clim, n=30):
+    """Contour levels spanning a climatology, rounded out to whole units."""
+    return np.linspace(np.floor(float(clim.min())), np.ceil(float(clim.max())), n)
+
+def plot_zonal_climatology(fig, ax, clim, levels, cmap, title, units, lat_dim="latitude"):
+    """Filled month-latitude contours with white contour lines and a colourbar."""
+    months = clim["month"].values
+    lats = clim[lat_dim].values
+    values = clim.transpose(lat_dim, "month").values
+    cf = ax.contourf(months, lats, values, levels=levels, cmap=cmap, extend="both")
+    ax.contour(months, lats, values, levels=levels, colors="white", linewidths=0.6)
+    ax.set_title(title)
+    ax.set_ylabel("Latitude (°)")
+    ax.set_xlabel("Month")
+    ax.set_xticks(months)
+    ax.set_xticklabels([MONTH_LABELS[m - 1] for m in months])
+    cbar = fig.colorbar(cf, ax=ax, pad=0.02)
+    cbar.set_label(f"({units})")
+    return cf
+
+def plot_zonal_climatology_and_bias(model_clim, obs_clim, units, model_title, bias_title,
+                                    clim_levels=None, diff_levels=None, lat_dim="latitude"):
+    """Two-panel figure: model climatology and model - obs bias, both (month, lat) on the same grid.
+
+    With `obs_clim` None only the climatology panel is drawn. Levels default to the
+    climatology's range and a symmetric range about zero for the bias.
+    """
+    if clim_levels is None:
+        clim_levels = climatology_levels(model_clim)
+    if obs_clim is None:
+        fig, ax = plt.subplots(figsize=(8, 6))
+        plot_zonal_climatology(fig, ax, model_clim, clim_levels, "Reds", model_title, units, lat_dim)
+        fig.tight_layout()
+        return fig
+
+    diff = model_clim - obs_clim
+    if diff_levels is None:
+        limit = np.ceil(float(abs(diff).max()))
+        diff_levels = np.linspace(-limit, limit, 31)
+    fig, axs = plt.subplots(1, 2, figsize=(14, 6), sharey=True)
+    plot_zonal_climatology(fig, axs[0], model_clim, clim_levels, "Reds", model_title, units, lat_dim)
+    plot_zonal_climatology(fig, axs[1], diff, diff_levels, "RdBu_r", bias_title, units, lat_dim)
+    axs[1].set_ylabel("")
+    fig.tight_layout()
+    return fig
+
+def plot_emmons_profile(ax, profile, title, species_label, model_label="model"):
+    """Obs (median, 25-75th percentile) and model (median, interquartile range) against altitude
+    for one campaign region, from a campaign_model_stats table."""
+    ax.plot(profile["median"], profile["alt"], "k-", lw=2, label="Obs")
+    ax.fill_betweenx(profile["alt"], profile["p25"], profile["p75"], color="grey", alpha=0.3)
+    ax.plot(profile["model_median"], profile["alt"], "r-", lw=2, label=model_label)
+    ax.fill_betweenx(profile["alt"], profile["model_p25"], profile["model_p75"], color="red", alpha=0.25)
+    ax.set_xlabel(species_label)
+    ax.set_ylabel("Altitude (km)")
+    ax.set_title(title, fontsize=10)
+    ax.grid(True)
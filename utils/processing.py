@@ -1,11 +1,117 @@
+import hashlib
+import json
+import os
+import threading
+import xarray as xr
+from utils.data_io import expand_paths, load_model_data
+
 def get_nearest_point(da, lat, lon):
     return da.sel(lat=lat, lon=lon, method="nearest")
 
-def filter_stations(stations, lat_min, lat_max, lon_min, lon_max):
-    return stations[
-        stations.Latitude.between(lat_min, lat_max) &
-        stations.Longitude.between(lon_min, lon_max)
-    ]
+def extract_stations(da, stations, index=None, name_col="Site Name", lat_col="Latitude", lon_col="Longitude"):
+    """Nearest grid-point series for every station in one pointwise selection, with a 'station' dim.
+
+    Pass a precomputed `index` (see `load_station_index`) to skip the nearest-cell search.
+    """
+    if index is None:
+        index = build_station_index(da.lat.values, da.lon.values, stations, name_col, lat_col, lon_col)
+    return gather_stations(da, index)
+
+def gather_stations(da, index):
+    """Integer gather of every station's grid cell from a DataArray or Dataset on the indexed grid."""
+    station = index["station"].to_numpy()
+    iy = xr.DataArray(index["lat_index"].to_numpy(), dims="station", coords={"station": station})
+    ix = xr.DataArray(index["lon_index"].to_numpy(), dims="station", coords={"station": station})
+    return da.isel(lat=iy, lon=ix)
+
+def grid_hash(lat, lon):
+    """Short hash identifying a lat/lon grid by its coordinate values."""
+    import numpy as np
+    h = hashlib.sha1(np.asarray(lat, dtype="f8").tobytes())
+    h.update(np.asarray(lon, dtype="f8").tobytes())
+    return h.hexdigest()[:16]
+
+def _unit_vectors(lat, lon):
+    import numpy as np
+    lat, lon = np.radians(lat), np.radians(lon)
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+def build_station_index(lat, lon, stations, name_col="Site Name", lat_col="Latitude", lon_col="Longitude"):
+    """Great-circle nearest grid cell of each station, from a KD-tree on unit-sphere coordinates.
+
+    Works across the dateline, near the poles and for either longitude convention.
+    Returns a DataFrame of station (as strings), lat_index and lon_index.
+    """
+    import numpy as np
+    import pandas as pd
+    from scipy.spatial import cKDTree
+    grid_lat, grid_lon = np.meshgrid(lat, lon, indexing="ij")
+    tree = cKDTree(_unit_vectors(grid_lat.ravel(), grid_lon.ravel()))
+    _, flat = tree.query(_unit_vectors(stations[lat_col].to_numpy(), stations[lon_col].to_numpy()))
+    lat_index, lon_index = np.unravel_index(flat, grid_lat.shape)
+    return pd.DataFrame({"station": stations[name_col].astype(str).to_numpy(), "lat_index": lat_index, "lon_index": lon_index})
+
+def station_table_hash(stations, name_col="Site Name", lat_col="Latitude", lon_col="Longitude"):
+    """Short hash identifying a station list by its names and positions."""
+    import pandas as pd
+    columns = stations[[name_col, lat_col, lon_col]]
+    return hashlib.sha1(pd.util.hash_pandas_object(columns, index=False).to_numpy().tobytes()).hexdigest()[:16]
+
+def load_station_index(lat, lon, stations, cache_dir="cache", name_col="Site Name", lat_col="Latitude", lon_col="Longitude"):
+    """`build_station_index`, saved to and reused from `cache_dir` keyed by grid and station hashes."""
+    import pandas as pd
+    station_hash = station_table_hash(stations, name_col, lat_col, lon_col)
+    index_file = os.path.join(cache_dir, "station_index", f"{grid_hash(lat, lon)}_{station_hash}.csv")
+    if os.path.exists(index_file):
+        # Station names stay strings, however numeric they look
+        return pd.read_csv(index_file, keep_default_na=False, dtype={"station": str})
+
+    index = build_station_index(lat, lon, stations, name_col, lat_col, lon_col)
+    os.makedirs(os.path.dirname(index_file), exist_ok=True)
+    tmp_file = f"{index_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    index.to_csv(tmp_file, index=False)
+    os.replace(tmp_file, index_file)
+    return index
+
+def filter_stations(stations, lat_min, lat_max, lon_min, lon_max, lat_col="Latitude", lon_col="Longitude"):
+    return stations[domain_mask(stations[lat_col].to_numpy(), stations[lon_col].to_numpy(),
+                                lat_min, lat_max, lon_min, lon_max)]
+
+def domain_mask(lat, lon, lat_min, lat_max, lon_min, lon_max):
+    """Boolean mask of points inside a lat/lon box, in one vectorized pass.
+
+    Longitudes may use either the -180..180 or the 0..360 convention, independently
+    for the points and the box. A box whose lon_min lies east of lon_max (e.g. 170
+    to -170) wraps across the dateline; a box spanning 360 degrees keeps all longitudes.
+    """
+    import numpy as np
+    lat = np.asarray(lat, dtype=float)
+    lon = np.mod(np.asarray(lon, dtype=float), 360)
+    in_lat = (lat >= lat_min) & (lat <= lat_max)
+    if lon_max - lon_min >= 360:
+        return in_lat
+    west, east = lon_min % 360, lon_max % 360
+    if west <= east:
+        in_lon = (lon >= west) & (lon <= east)
+    else:
+        in_lon = (lon >= west) | (lon <= east)
+    return in_lat & in_lon
+
+def grid_domain(lat, lon):
+    """(lat_min, lat_max, lon_min, lon_max) covered by a grid's cells, not just their centres.
+
+    Grids whose cells go all the way round the globe get a 360-degree longitude range.
+    """
+    import numpy as np
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    dlat = float(abs(lat[1] - lat[0])) / 2 if lat.size > 1 else 0.0
+    dlon = float(abs(lon[1] - lon[0])) / 2 if lon.size > 1 else 0.0
+    lat_min = max(float(lat.min()) - dlat, -90.0)
+    lat_max = min(float(lat.max()) + dlat, 90.0)
+    if lon.size * 2 * dlon >= 360 - 1e-6:
+        return lat_min, lat_max, -180.0, 180.0
+    return lat_min, lat_max, float(lon[0]) - dlon, float(lon[-1]) + dlon
 
 def mean_bias_error(obs, mod):
     return 100 * ((mod - obs).mean() / obs.mean()).item()
@@ -13,3 +119,350 @@ def mean_bias_error(obs, mod):
 def correlation(obs, mod):
     import numpy as np
     return np.corrcoef(obs, mod)[0, 1]
+
+def file_fingerprint(path):
+    """(absolute path, mtime, size) for every file matched by a path, glob or list."""
+    fingerprint = []
+    for p in expand_paths(path):
+        st = os.stat(p)
+        fingerprint.append((os.path.abspath(p), st.st_mtime_ns, st.st_size))
+    return fingerprint
+
+def climatology_cache_key(path, var_name, level, reduction, **extra):
+    """Hash of the source files' fingerprint plus everything else that defines a climatology."""
+    payload = {"files": file_fingerprint(path), "var_name": var_name, "level": level,
+               "reduction": reduction, **extra}
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+def cached_climatology(compute, path, var_name, level, reduction, cache_dir="cache", max_cache_mb=500, **extra):
+    """Return the Dataset made by `compute()`, reusing a copy cached on disk where possible.
+
+    Entries live in `cache_dir` as compressed NetCDF keyed by `climatology_cache_key`,
+    so a hit never opens the source files. Once the directory grows past
+    `max_cache_mb` the least recently used entries are removed.
+    """
+    key = climatology_cache_key(path, var_name, level, reduction, **extra)
+    return cached_dataset(compute, key, cache_dir=cache_dir, max_cache_mb=max_cache_mb)
+
+def cache_file_path(key, cache_dir="cache"):
+    return os.path.join(cache_dir, f"{key}.nc")
+
+def cached_dataset(compute, key, cache_dir="cache", max_cache_mb=500):
+    """Return the Dataset made by `compute()`, or the copy cached on disk under `key`.
+
+    The cache is shared with `cached_climatology`, so the same size limit and
+    least-recently-used eviction apply.
+    """
+    cache_file = cache_file_path(key, cache_dir)
+    if os.path.exists(cache_file):
+        os.utime(cache_file)
+        with xr.open_dataset(cache_file) as ds:
+            return ds.load()
+
+    result = compute()
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    encoding = {name: {"zlib": True, "complevel": 4} for name in result.data_vars}
+    result.to_netcdf(tmp_file, encoding=encoding)
+    os.replace(tmp_file, cache_file)
+    evict_cache(cache_dir, max_cache_mb, keep=cache_file)
+    return result
+
+def evict_cache(cache_dir, max_cache_mb, keep=None):
+    """Delete least recently used cache entries until the directory fits in `max_cache_mb`."""
+    entries = []
+    for name in os.listdir(cache_dir):
+        p = os.path.join(cache_dir, name)
+        if name.endswith(".nc") and p != keep:
+            try:
+                st = os.stat(p)
+            except FileNotFoundError:  # evicted by another worker meanwhile
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+    total = sum(size for _, size, _ in entries)
+    if keep is not None and os.path.exists(keep):
+        total += os.path.getsize(keep)
+    for _, size, p in sorted(entries):
+        if total <= max_cache_mb * 1024 ** 2:
+            break
+        try:
+            os.remove(p)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+def station_climatology(path, var_name, stations, level=None, chunks=None, cache_dir="cache", max_cache_mb=500):
+    """Monthly stats (as `streaming_monthly_stats`) of `var_name` at every station inside the grid of `path`.
+
+    Cached with `cached_climatology`, keyed on the station list's `station_table_hash`
+    too. A module-level function so it can be sent to worker processes.
+    """
+    def compute():
+        ds = load_model_data(path, chunks=chunks, level=level)
+        sites = filter_stations(stations, *grid_domain(ds.lat.values, ds.lon.values))
+        index = load_station_index(ds.lat.values, ds.lon.values, sites, cache_dir=cache_dir)
+        return streaming_monthly_stats(extract_stations(ds[var_name], sites, index=index))
+    return cached_climatology(compute, path, var_name, level, "station_monthly_stats",
+                              cache_dir=cache_dir, max_cache_mb=max_cache_mb, stations=station_table_hash(stations))
+
+def model_labels(models):
+    """Label for each entry of a config `models:` list: its name, plus its ensemble member if given.
+
+    Raises ValueError if two entries get the same label, as they couldn't be told apart.
+    """
+    labels = [f"{m['name']} {m['member']}" if m.get("member") else m["name"] for m in models]
+    duplicates = sorted({label for label in labels if labels.count(label) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate model labels {duplicates}: give each model a different name or member")
+    return labels
+
+def reduce_models(reduce, models, processes=None, **kwargs):
+    """Run `reduce(file, **kwargs)` for every model in parallel and stack the results along "model".
+
+    `models` is a list of dicts with name, file (path, glob or list) and
+    optionally member. Any other keys of an entry are passed to `reduce` for
+    that entry only, in place of the same `kwargs` (e.g. an obs file whose
+    var_name or dims differ from the models'). `reduce` must be a module-level
+    function so it can be sent to the worker processes; processes=1 runs them
+    one after another.
+    The result has a "model" dimension labelled by `model_labels` with "run"
+    and "member" coordinates, so ensemble members can be grouped by run.
+    Points missing from some models (e.g. stations outside a regional grid)
+    are NaN for those models. Call it before opening any data in the calling
+    process: the workers are forked, and forking while netCDF or dask threads
+    are busy can leave them hanging.
+    """
+    import pandas as pd
+    from concurrent.futures import ProcessPoolExecutor
+    from functools import partial
+    files = [m["file"] for m in models]
+    options = [{**kwargs, **{k: v for k, v in m.items() if k not in ("name", "member", "file")}} for m in models]
+    if processes == 1 or len(models) < 2:
+        results = [reduce(f, **o) for f, o in zip(files, options)]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = list(pool.map(partial(_call_reduce, reduce), files, options))
+    stacked = xr.concat(results, dim=pd.Index(model_labels(models), name="model"), join="outer")
+    return stacked.assign_coords(run=("model", [m["name"] for m in models]),
+                                 member=("model", [m.get("member") or "" for m in models]))
+
+def _call_reduce(reduce, path, options):
+    return reduce(path, **options)
+
+def zonal_climatology(path, var_name, dims=None, chunks=None, cache_dir="cache", max_cache_mb=500):
+    """`compute_zonal_climatology` of `var_name` in `path`, as a Dataset with a "climatology" variable.
+
+    Cached with `cached_climatology` under the same key as the climatologies of
+    plot_ozone_zonal_climatology.py. A module-level function so it can be sent
+    to worker processes by `reduce_models`.
+    """
+    def compute():
+        da = load_model_data(path, chunks=chunks)[var_name]
+        return compute_zonal_climatology(da, dims).load().to_dataset(name="climatology")
+    return cached_climatology(compute, path, var_name, None, "zonal_climatology",
+                              cache_dir=cache_dir, max_cache_mb=max_cache_mb, dims=dims)
+
+def time_coverage(path, dims=None):
+    """First and last `monthly_period_index` of the times in `path`, along a "bound" dimension."""
+    from utils.time_align import monthly_period_index
+    time_dim = (dims or {}).get("time", "time")
+    with load_model_data(path) as ds:
+        periods = monthly_period_index(ds[time_dim])
+    return xr.DataArray([periods.min(), periods.max()], dims="bound", coords={"bound": ["first", "last"]})
+
+SEASONS = ("DJF", "MAM", "JJA", "SON")
+
+def seasonal_zonal_stats(path, var_name, period, dims=None, lat_from=None, chunks=None):
+    """Zonal mean and spread of `var_name` in each season, and the year, over `period`.
+
+    `period` is the (first, last) `monthly_period_index` to use, so datasets on
+    different calendars cover the same months (see `time_coverage`). "mean" is
+    the time mean and "std" the standard deviation over time, each then
+    averaged over longitude, with a "season" dimension (SEASONS, then "Annual")
+    and "lat" in place of the file's latitude. `dims` maps the roles "time",
+    "lat" and "lon" to the names in the file (defaults time, latitude, longitude).
+    `lat_from`, a dict with the file and dims of another dataset (e.g. the obs
+    entry of a `reduce_models` list), interpolates onto that dataset's
+    latitudes before anything is averaged, so stacked results share them.
+    """
+    import pandas as pd
+    from utils.time_align import monthly_period_index
+    dims = {"time": "time", "lat": "latitude", "lon": "longitude", **(dims or {})}
+    time_dim, lon_dim = dims["time"], dims["lon"]
+    da = load_model_data(path, chunks=chunks)[var_name].rename({dims["lat"]: "lat"})
+    if lat_from is not None:
+        with load_model_data(lat_from["file"]) as target:
+            lat = target[(lat_from.get("dims") or {}).get("lat", "latitude")].values
+        da = da.interp(lat=lat)
+    periods = monthly_period_index(da[time_dim])
+    da = da.isel({time_dim: (periods >= period[0]) & (periods <= period[1])})
+    groups = [da.isel({time_dim: da[f"{time_dim}.season"] == season}) for season in SEASONS] + [da]
+    season = pd.Index(list(SEASONS) + ["Annual"], name="season")
+    return xr.Dataset({
+        "mean": xr.concat([g.mean(time_dim).mean(lon_dim) for g in groups], dim=season),
+        "std": xr.concat([g.std(time_dim).mean(lon_dim) for g in groups], dim=season),
+    }).load()
+
+def streaming_monthly_stats(da, time_dim="time", block_size=120, ddof=0):
+    """Monthly mean, std, min, max and count from a single pass over `time_dim`.
+
+    The time axis is read `block_size` steps at a time; each block is reduced to
+    per-month count/mean/M2 and merged into running totals (the pairwise form of
+    Welford's algorithm), so memory depends on the block size, not the run length.
+    NaNs are skipped. Returns a Dataset with a 'month' dimension in place of time.
+    """
+    import numpy as np
+    other_dims = [d for d in da.dims if d != time_dim]
+    shape = (12,) + tuple(da.sizes[d] for d in other_dims)
+    count = np.zeros(shape)
+    mean = np.zeros(shape)
+    m2 = np.zeros(shape)
+    vmin = np.full(shape, np.nan)
+    vmax = np.full(shape, np.nan)
+    months = da[time_dim].dt.month.values
+
+    for start in range(0, da.sizes[time_dim], block_size):
+        block_slice = slice(start, start + block_size)
+        block = np.asarray(da.isel({time_dim: block_slice}).transpose(time_dim, *other_dims).values, dtype=float)
+        block_months = months[block_slice]
+        for month in np.unique(block_months):
+            i = month - 1
+            x = block[block_months == month]
+            n_b = np.sum(~np.isnan(x), axis=0)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean_b = np.nansum(x, axis=0) / n_b
+                m2_b = np.nansum((x - mean_b) ** 2, axis=0)
+                n = count[i] + n_b
+                delta = mean_b - mean[i]
+                has_data = n_b > 0
+                mean[i] = np.where(has_data, mean[i] + delta * n_b / n, mean[i])
+                m2[i] = np.where(has_data, m2[i] + m2_b + delta ** 2 * count[i] * n_b / n, m2[i])
+            count[i] = n
+            vmin[i] = np.fmin(vmin[i], np.fmin.reduce(x, axis=0))
+            vmax[i] = np.fmax(vmax[i], np.fmax.reduce(x, axis=0))
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(count > 0, mean, np.nan)
+        std = np.sqrt(np.where(count > ddof, m2 / (count - ddof), np.nan))
+
+    template = da.isel({time_dim: 0}, drop=True)
+    dims = ("month",) + tuple(other_dims)
+    coords = {**template.coords, "month": np.arange(1, 13)}
+    return xr.Dataset(
+        {name: (dims, values) for name, values in
+         [("mean", mean), ("std", std), ("min", vmin), ("max", vmax), ("count", count)]},
+        coords=coords,
+    )
+
+def compute_zonal_climatology(da, dims=None):
+    """Monthly zonal-mean climatology of `da`, with a 'month' dimension (1-12) in place of time.
+
+    `dims` maps the roles "time" and "lon" to the names used in `da` (defaults
+    'time' and 'longitude'), e.g. {"time": "t"} for the OMI/MLS files. Longitude
+    and the time steps within each month are averaged together in one groupby
+    reduction, so dask-backed data stays lazy until it is computed and each
+    chunk is only read once. Data without the longitude dimension (already
+    zonal means) are just averaged over time. NaNs are skipped, so each month
+    is the mean of all its valid (time, longitude) values.
+    """
+    dims = {"time": "time", "lon": "longitude", **(dims or {})}
+    time_dim, lon_dim = dims["time"], dims["lon"]
+    reduce_dims = [time_dim] + ([lon_dim] if lon_dim in da.dims else [])
+    return da.groupby(f"{time_dim}.month").mean(reduce_dims)
+
+class QuantileSketch:
+    """Mergeable streaming quantile estimator (a KLL sketch) for one distribution.
+
+    Values are added chunk by chunk with `update` and sketches built on
+    different chunks, files or worker processes combine with `merge`, so a
+    box's distribution never has to be held in memory or sorted in full.
+    Memory stays around 3 * k values whatever the count.
+
+    The count, mean and standard deviation are tracked exactly alongside
+    (merged with Chan's pairwise formula). Quantiles are returned as one of
+    the values added, not interpolated between them.
+
+    Error bound: the sketch is exact until it first fills up (about 3 * k
+    values). After that the rank of a returned quantile is within about
+    1.65% of the count at k=200 with 99% confidence. The error scales
+    roughly as 1/k, so k=400 gives about 0.8%. Merged sketches keep the same
+    bound as a single sketch fed all the values.
+    """
+
+    def __init__(self, k=200, seed=None):
+        import numpy as np
+        self.k = k
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        import numpy as np
+        depth = len(self.levels) - 1 - level
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def update(self, values):
+        """Add an array of values; NaNs are ignored."""
+        import numpy as np
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        if values.size:
+            self._merge_moments(values.size, values.mean(), np.sum((values - values.mean()) ** 2))
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+        return self
+
+    def merge(self, other):
+        """Fold another sketch (of the same k) into this one."""
+        import numpy as np
+        if other.k != self.k:
+            raise ValueError(f"Can't merge sketches with k={self.k} and k={other.k}")
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        if other.count:
+            self._merge_moments(other.count, other.mean, other._m2)
+        self._compress()
+        return self
+
+    def _merge_moments(self, count, mean, m2):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self._m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+    def std(self, ddof=0):
+        """Standard deviation of everything added; NaN if there are not enough values."""
+        return (self._m2 / (self.count - ddof)) ** 0.5 if self.count > ddof else float("nan")
+
+    def _compress(self):
+        # Halve any level over its capacity: sort it and promote every other
+        # item (from a random start) to the next level, where each item stands
+        # for twice as many values
+        import numpy as np
+        while sum(len(items) for items in self.levels) > sum(self._capacity(h) for h in range(len(self.levels))):
+            level = next(h for h in range(len(self.levels)) if len(self.levels[h]) > self._capacity(h))
+            if level == len(self.levels) - 1:
+                self.levels.append(np.empty(0))
+            items = np.sort(self.levels[level])
+            leftover = items[:1] if len(items) % 2 else items[:0]
+            items = items[len(leftover):]
+            promoted = items[self._rng.integers(2)::2]
+            self.levels[level] = leftover
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+
+    def quantile(self, q):
+        """Estimated quantile(s) q in [0, 1]; NaN if nothing has been added."""
+        import numpy as np
+        items = np.concatenate(self.levels)
+        if items.size == 0:
+            return np.full(np.shape(q), np.nan)
+        weights = np.concatenate([np.full(len(level_items), 2.0 ** h) for h, level_items in enumerate(self.levels)])
+        order = np.argsort(items)
+        items, cumulative = items[order], np.cumsum(weights[order])
+        ranks = np.asarray(q, dtype=float) * cumulative[-1]
+        return items[np.minimum(np.searchsorted(cumulative, ranks, side="left"), items.size - 1)]
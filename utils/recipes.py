@@ -0,0 +1,245 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+from utils.data_io import load_model_data, load_station_csv
+from utils.processing import (file_fingerprint, cached_dataset, cache_file_path, compute_zonal_climatology,
+                              streaming_monthly_stats, filter_stations, grid_domain, load_station_index,
+                              extract_stations)
+from utils.units import convert
+
+# Kinds of node, in pipeline order. Reduce and compare results are cached on
+# disk; load and select are lazy and cheap, and render always runs.
+NODE_KINDS = ("load", "select", "reduce", "compare", "render")
+CACHED_KINDS = ("reduce", "compare")
+
+class Node:
+    """One step of a recipe graph: `OPS[kind][op](params, *input results)`.
+
+    The key hashes the kind, op, params and the keys of the inputs, so the same
+    step asked for by several diagnostics is one node, and a change anywhere
+    upstream (including the source files, through the load node's fingerprint)
+    gives a new key and so a cache miss.
+    """
+    def __init__(self, kind, op, params, inputs=()):
+        if kind not in NODE_KINDS:
+            raise ValueError(f"Unknown node kind {kind!r}")
+        self.kind, self.op, self.params, self.inputs = kind, op, params, tuple(inputs)
+        payload = {"kind": kind, "op": op, "params": params, "inputs": [n.key for n in self.inputs]}
+        self.key = hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+    def __repr__(self):
+        return f"<{self.kind}:{self.op} {self.key[:8]}>"
+
+class RecipeGraph:
+    """Nodes by key; `add` returns the existing node when an identical one was already added."""
+    def __init__(self):
+        self.nodes = {}
+        self.requested = 0
+
+    def add(self, kind, op, params, inputs=()):
+        node = Node(kind, op, params, inputs)
+        self.requested += 1
+        return self.nodes.setdefault(node.key, node)
+
+# ---- ops: each takes the node's params and its inputs' results ----
+
+def _open(params):
+    return load_model_data(params["path"], chunks=params["chunks"])
+
+def _variable(params, ds):
+    da = ds[params["var_name"]]
+    if params["level"] is not None:
+        da = da.sel({params["lev_dim"]: params["level"]}, method="nearest")
+    if params["units"] is not None:
+        da = convert(da, *params["units"])
+    return da
+
+def _station_monthly_stats(params, da, cache_dir="cache"):
+    stations = load_station_csv(params["stations_csv"]).drop_duplicates("Site Name")
+    sites = filter_stations(stations, *grid_domain(da.lat.values, da.lon.values))
+    index = load_station_index(da.lat.values, da.lon.values, sites, cache_dir=cache_dir)
+    return streaming_monthly_stats(extract_stations(da, sites, index=index))
+
+def _zonal_climatology(params, da, cache_dir="cache"):
+    return compute_zonal_climatology(da, params["dims"]).load().to_dataset(name="climatology")
+
+def _station_stats(params, obs_clim, mod_clim, cache_dir="cache"):
+    from utils.stats import compute_stats
+    return compute_stats(obs_clim["mean"], mod_clim["mean"], dim="month")
+
+def _regrid_lat(params, src, dst, cache_dir="cache"):
+    """`src` on `dst`'s latitudes (conservatively regridded unless they already match)."""
+    from utils.regrid import regrid_conservative
+    src_lat, lat = params["src_lat_dim"], params["lat_dim"]
+    if src_lat != lat:
+        src = src.rename({src_lat: lat})
+    if np.array_equal(src[lat], dst[lat]):
+        return src
+    return regrid_conservative(src, dst[lat].values, lat_dim=lat, cache_dir=cache_dir)
+
+def _render_station_seasonal(params, obs_clim, mod_clim, stats):
+    from utils.plot_utils import set_plot_style, station_panels, render_station_pages
+    stations = load_station_csv(params["stations_csv"]).drop_duplicates("Site Name")
+    stations = stations[stations["Site Name"].isin(obs_clim.station.values)]
+    set_plot_style()
+    panels = station_panels(stations, obs_clim, mod_clim, stats)
+    return render_station_pages(panels, params["output_pdf"], params["ylim"], params["plot_units"],
+                                processes=params["processes"])
+
+def _render_zonal_climatology(params, model_clim, obs_clim=None):
+    import matplotlib.pyplot as plt
+    from utils.plot_utils import set_plot_style, plot_zonal_climatology_and_bias
+    set_plot_style()
+    diff_levels = params["diff_levels"]
+    fig = plot_zonal_climatology_and_bias(
+        model_clim["climatology"], obs_clim["climatology"] if obs_clim is not None else None, params["units"],
+        model_title=params["title"], bias_title=params["bias_title"],
+        diff_levels=np.arange(*diff_levels) if diff_levels is not None else None,
+        lat_dim=params["lat_dim"],
+    )
+    fig.savefig(params["output_pdf"])
+    plt.close(fig)
+
+OPS = {
+    "load": {"open": _open},
+    "select": {"variable": _variable},
+    "reduce": {"station_monthly_stats": _station_monthly_stats, "zonal_climatology": _zonal_climatology},
+    "compare": {"station_stats": _station_stats, "regrid_lat": _regrid_lat},
+    "render": {"station_seasonal": _render_station_seasonal, "zonal_climatology": _render_zonal_climatology},
+}
+
+# ---- recipe -> graph ----
+
+def _selected(graph, dataset, to_units=None):
+    """Load and select nodes for a recipe dataset entry, optionally converted to `to_units`."""
+    load = graph.add("load", "open", {"path": dataset["file"], "files": file_fingerprint(dataset["file"]),
+                                      "chunks": dataset.get("chunks")})
+    units = None
+    if to_units is not None and dataset.get("units") not in (None, to_units):
+        units = [dataset["units"], to_units]
+    return graph.add("select", "variable", {"var_name": dataset["var_name"], "level": dataset.get("level"),
+                                            "lev_dim": dataset.get("lev_dim", "lev"), "units": units}, [load])
+
+def _station_seasonal_nodes(graph, diag, datasets):
+    plot_units = diag["plot_units"]
+    stations = {"stations_csv": diag["stations_csv"], "stations": file_fingerprint(diag["stations_csv"])}
+    obs, mod = (graph.add("reduce", "station_monthly_stats", stations,
+                          [_selected(graph, datasets[diag[role]], plot_units)]) for role in ("obs", "model"))
+    stats = graph.add("compare", "station_stats", {}, [obs, mod])
+    return graph.add("render", "station_seasonal", {
+        "stations_csv": diag["stations_csv"], "output_pdf": diag["output_pdf"], "ylim": diag.get("ylim"),
+        "plot_units": plot_units, "processes": diag.get("processes"),
+    }, [obs, mod, stats])
+
+def _zonal_climatology_nodes(graph, diag, datasets):
+    def lat_dim(name):
+        return datasets[name].get("dims", {}).get("lat", "latitude")
+
+    def climatology(name):
+        return graph.add("reduce", "zonal_climatology", {"dims": datasets[name].get("dims")},
+                         [_selected(graph, datasets[name], diag.get("units"))])
+
+    model, obs = diag["model"], diag.get("obs")
+    inputs = [climatology(model)]
+    if obs is not None:
+        inputs.append(graph.add("compare", "regrid_lat", {"src_lat_dim": lat_dim(obs), "lat_dim": lat_dim(model)},
+                                [climatology(obs), inputs[0]]))
+    model_label = datasets[model].get("label", model)
+    obs_label = datasets[obs].get("label", obs) if obs is not None else None
+    return graph.add("render", "zonal_climatology", {
+        "output_pdf": diag["output_pdf"], "units": diag.get("units", datasets[model].get("units", "")),
+        "title": diag.get("title", model_label),
+        "bias_title": diag.get("bias_title", f"Bias ({model_label} - {obs_label})" if obs else ""),
+        "diff_levels": diag.get("diff_levels"), "lat_dim": lat_dim(model),
+    }, inputs)
+
+DIAGNOSTICS = {
+    "station_seasonal": _station_seasonal_nodes,
+    "zonal_climatology": _zonal_climatology_nodes,
+}
+
+def build_graph(recipe):
+    """The deduplicated node graph for a recipe, and its render nodes in recipe order.
+
+    `recipe["datasets"]` names each file/variable once; each entry of
+    `recipe["diagnostics"]` has a `type` from DIAGNOSTICS and refers to datasets
+    by name. Diagnostics sharing a file, variable or reduction share those nodes.
+    """
+    graph = RecipeGraph()
+    renders = []
+    for diag in recipe["diagnostics"]:
+        if diag["type"] not in DIAGNOSTICS:
+            raise ValueError(f"Unknown diagnostic type {diag['type']!r} in {diag.get('name', diag)}")
+        renders.append(DIAGNOSTICS[diag["type"]](graph, diag, recipe["datasets"]))
+    return graph, renders
+
+# ---- execution ----
+
+def plan(renders, cache_dir="cache"):
+    """The nodes the renders need, each with the keys it waits on (None for a cache hit).
+
+    Walks up from the renders and stops at cached nodes already on disk, so
+    their inputs (and the files behind them) are never opened.
+    """
+    needed = {}
+    def visit(node):
+        if node.key in needed:
+            return
+        hit = node.kind in CACHED_KINDS and os.path.exists(cache_file_path(node.key, cache_dir))
+        if hit:
+            # Most recently used now, so entries written during the run evict others first
+            os.utime(cache_file_path(node.key, cache_dir))
+        needed[node.key] = (node, None if hit else [n.key for n in node.inputs])
+        if not hit:
+            for n in node.inputs:
+                visit(n)
+    for node in renders:
+        visit(node)
+    return needed
+
+def _execute(node, inputs, cache_dir, max_cache_mb):
+    """Run one node on its inputs' results.
+
+    `inputs` None means the node was planned as a cache hit. If its entry has
+    gone by the time it runs (evicted by another step's write), its inputs are
+    worked out here, in this thread, the same way.
+    """
+    op = OPS[node.kind][node.op]
+    def compute():
+        args = inputs if inputs is not None else [_execute(n, None, cache_dir, max_cache_mb) for n in node.inputs]
+        return op(node.params, *args, **({"cache_dir": cache_dir} if node.kind in CACHED_KINDS else {}))
+    if node.kind in CACHED_KINDS:
+        return cached_dataset(compute, node.key, cache_dir=cache_dir, max_cache_mb=max_cache_mb)
+    return compute()
+
+def run_graph(renders, threads=None, cache_dir="cache", max_cache_mb=500, log=print):
+    """Run everything the render nodes need, then the renders themselves.
+
+    Independent load/select/reduce/compare nodes run concurrently on `threads`
+    threads as soon as their inputs are ready. The renders follow one after
+    another in this thread once the pool is idle: pyplot is not thread-safe,
+    and the station renderer forks its own page workers.
+    """
+    needed = plan(renders, cache_dir)
+    waiting = {key: set(deps or ()) for key, (node, deps) in needed.items() if node.kind != "render"}
+    results = {}
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        running = {}
+        while waiting or running:
+            for key in [k for k, deps in waiting.items() if deps.issubset(results)]:
+                node = needed[key][0]
+                inputs = [results[n.key] for n in node.inputs] if needed[key][1] is not None else None
+                running[pool.submit(_execute, node, inputs, cache_dir, max_cache_mb)] = key
+                del waiting[key]
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = running.pop(future)
+                results[key] = future.result()
+                log(f"done {needed[key][0]!r}")
+
+    for node in renders:
+        if _execute(node, [results[n.key] for n in node.inputs], cache_dir, max_cache_mb) is not False:
+            log(f"rendered '{node.params['output_pdf']}'")
+    return results
@@ -0,0 +1,125 @@
+import os
+import numpy as np
+import scipy.sparse
+import xarray as xr
+from utils.processing import grid_hash
+
+def cell_edges(centres):
+    """Cell edges for 1D cell centres: midpoints, with the end cells as wide as their neighbours.
+
+    A single cell is taken to span a full circle (e.g. a zonal-mean longitude)."""
+    centres = np.asarray(centres, dtype=float)
+    if centres.size == 1:
+        return np.array([centres[0] - 180.0, centres[0] + 180.0])
+    mid = 0.5 * (centres[1:] + centres[:-1])
+    return np.concatenate([[2 * centres[0] - mid[0]], mid, [2 * centres[-1] - mid[-1]]])
+
+def _overlaps(src_edges, dst_edges, period=None):
+    """Dense (n_dst, n_src) lengths of overlap between 1D cells, optionally periodic."""
+    src_lo = np.minimum(src_edges[:-1], src_edges[1:])
+    src_hi = np.maximum(src_edges[:-1], src_edges[1:])
+    dst_lo = np.minimum(dst_edges[:-1], dst_edges[1:])[:, None]
+    dst_hi = np.maximum(dst_edges[:-1], dst_edges[1:])[:, None]
+    shifts = [0.0]
+    if period is not None:
+        # Bring both grids to start in [0, period) so one period either way covers every match
+        src_offset = period * np.floor(src_lo.min() / period)
+        dst_offset = period * np.floor(dst_lo.min() / period)
+        src_lo, src_hi = src_lo - src_offset, src_hi - src_offset
+        dst_lo, dst_hi = dst_lo - dst_offset, dst_hi - dst_offset
+        shifts = [-period, 0.0, period]
+    overlap = np.zeros((dst_lo.shape[0], src_lo.shape[0]))
+    for shift in shifts:
+        overlap += np.clip(np.minimum(dst_hi, src_hi + shift) - np.maximum(dst_lo, src_lo + shift), 0, None)
+    return overlap
+
+def lat_overlaps(src_lat, dst_lat):
+    """Sparse (n_dst, n_src) overlap areas of latitude bands, in sin(latitude) so they are proportional to area."""
+    src = np.sin(np.radians(np.clip(cell_edges(src_lat), -90, 90)))
+    dst = np.sin(np.radians(np.clip(cell_edges(dst_lat), -90, 90)))
+    return scipy.sparse.csr_matrix(_overlaps(src, dst))
+
+def lon_overlaps(src_lon, dst_lon):
+    """Sparse (n_dst, n_src) overlap widths of longitude cells, wrapping at 360 degrees."""
+    return scipy.sparse.csr_matrix(_overlaps(cell_edges(src_lon), cell_edges(dst_lon), period=360.0))
+
+def conservative_weights(src_lat, src_lon, dst_lat, dst_lon):
+    """Sparse matrix of overlap areas from a source to a destination rectilinear grid.
+
+    Rows are destination cells and columns source cells, both flattened (lat, lon)
+    in C order; it is the Kronecker product of the latitude and longitude
+    overlaps. With `src_lon`/`dst_lon` None the grids are latitude only (e.g.
+    zonal means). The weights are not normalised: `apply_weights` divides by the
+    overlap with valid data, so missing values and partial coverage are handled.
+    """
+    weights = lat_overlaps(src_lat, dst_lat)
+    if src_lon is not None:
+        weights = scipy.sparse.kron(weights, lon_overlaps(src_lon, dst_lon), format="csr")
+    weights.eliminate_zeros()
+    return weights
+
+def load_conservative_weights(src_lat, src_lon, dst_lat, dst_lon, cache_dir="cache"):
+    """`conservative_weights`, saved to and reused from `cache_dir` keyed by the two grids' hashes."""
+    src_key = grid_hash(src_lat, src_lon if src_lon is not None else [])
+    dst_key = grid_hash(dst_lat, dst_lon if dst_lon is not None else [])
+    kind = "latlon" if src_lon is not None else "lat"
+    weights_file = os.path.join(cache_dir, "regrid", f"{kind}_{src_key}_{dst_key}.npz")
+    if os.path.exists(weights_file):
+        return scipy.sparse.load_npz(weights_file)
+
+    weights = conservative_weights(src_lat, src_lon, dst_lat, dst_lon)
+    os.makedirs(os.path.dirname(weights_file), exist_ok=True)
+    tmp_file = weights_file[:-len(".npz")] + f".tmp{os.getpid()}.npz"
+    scipy.sparse.save_npz(tmp_file, weights)
+    os.replace(tmp_file, weights_file)
+    return weights
+
+def apply_weights(values, weights, dst_shape, grid_ndim):
+    """Regrid the last `grid_ndim` axes of `values` with one sparse matmul over every leading index.
+
+    Each destination cell is the area-weighted mean of the valid source values
+    that overlap it, and NaN where none do.
+    """
+    lead_shape = values.shape[:values.ndim - grid_ndim]
+    flat = values.reshape(int(np.prod(lead_shape)), -1).T
+    valid = ~np.isnan(flat)
+    total = weights @ np.where(valid, flat, 0.0)
+    coverage = weights @ valid.astype(float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = np.where(coverage > 0, total / coverage, np.nan)
+    return out.T.reshape(lead_shape + tuple(dst_shape))
+
+def regrid_conservative(da, dst_lat, dst_lon=None, lat_dim="latitude", lon_dim="longitude", cache_dir="cache"):
+    """First-order conservative regridding of `da` onto the destination latitudes (and longitudes).
+
+    Without `dst_lon`, or if `da` has no `lon_dim`, only latitude is regridded (for
+    zonal means). Every time step (and any other dimension) goes through the same
+    cached sparse weights at once; dask-backed data is regridded chunk by chunk.
+    """
+    dst_lat = np.asarray(dst_lat)
+    grid_dims = [lat_dim]
+    src_lon = None
+    if dst_lon is not None and lon_dim in da.dims:
+        dst_lon = np.asarray(dst_lon)
+        grid_dims.append(lon_dim)
+        src_lon = da[lon_dim].values
+    else:
+        dst_lon = None
+    weights = load_conservative_weights(da[lat_dim].values, src_lon, dst_lat, dst_lon, cache_dir=cache_dir)
+    dst_shape = (dst_lat.size,) + ((dst_lon.size,) if dst_lon is not None else ())
+
+    if da.chunks is not None:
+        da = da.chunk({d: -1 for d in grid_dims})
+    new_dims = [f"{d}_regridded" for d in grid_dims]
+    out = xr.apply_ufunc(
+        lambda values: apply_weights(values, weights, dst_shape, len(grid_dims)),
+        da,
+        input_core_dims=[grid_dims],
+        output_core_dims=[new_dims],
+        dask="parallelized",
+        output_dtypes=[float],
+        dask_gufunc_kwargs={"output_sizes": dict(zip(new_dims, dst_shape))},
+    )
+    out = out.rename(dict(zip(new_dims, grid_dims)))
+    out = out.assign_coords({lat_dim: dst_lat, **({lon_dim: dst_lon} if dst_lon is not None else {})})
+    return out.transpose(*da.dims)
@@ -0,0 +1,39 @@
+import numpy as np
+import xarray as xr
+
+def compute_stats(obs, mod, dim="month"):
+    """Model-vs-obs statistics along `dim`, for every other point (station, grid cell, ...) at once.
+
+    Only pairs where both obs and mod are present are used. Returns a Dataset of:
+    n, bias (mod - obs mean), nmb (normalised mean bias in %, as
+    processing.mean_bias_error), rmse, r, std_ratio (mod/obs standard deviation)
+    and crmse (centred RMS difference). std_ratio, r and crmse / obs std are the
+    Taylor-diagram coordinates.
+    """
+    valid = obs.notnull() & mod.notnull()
+    obs = obs.where(valid)
+    mod = mod.where(valid)
+
+    obs_mean = obs.mean(dim)
+    mod_mean = mod.mean(dim)
+    obs_anom = obs - obs_mean
+    mod_anom = mod - mod_mean
+    obs_std = np.sqrt((obs_anom ** 2).mean(dim))
+    mod_std = np.sqrt((mod_anom ** 2).mean(dim))
+
+    bias = mod_mean - obs_mean
+    return xr.Dataset({
+        "n": valid.sum(dim),
+        "bias": bias,
+        "nmb": 100 * bias / obs_mean,
+        "rmse": np.sqrt(((mod - obs) ** 2).mean(dim)),
+        "r": (obs_anom * mod_anom).mean(dim) / (obs_std * mod_std),
+        "std_ratio": mod_std / obs_std,
+        "crmse": np.sqrt(((mod_anom - obs_anom) ** 2).mean(dim)),
+        "obs_std": obs_std,
+        "mod_std": mod_std,
+    })
+
+def stats_table(obs, mod, dim="month"):
+    """`compute_stats` as a tidy DataFrame, one row per station or grid cell."""
+    return compute_stats(obs, mod, dim).to_dataframe().reset_index()
@@ -0,0 +1,46 @@
+import datetime
+import numpy as np
+
+def monthly_period_index(times):
+    """Integer month number (year * 12 + month - 1) for each time, whatever the calendar.
+
+    `times` may be an xarray time coordinate (numpy datetime64 or cftime, e.g.
+    UKESM's 360-day calendar), an iris time coord, or a sequence of anything
+    with year and month attributes. Mid-month 360-day and Gregorian times for
+    the same month get the same number, so datasets can be matched month by month.
+    """
+    if hasattr(times, "dt"):
+        return (times.dt.year.values * 12 + times.dt.month.values - 1).astype(int)
+    if hasattr(times, "units") and hasattr(times, "points"):
+        times = times.units.num2date(times.points)
+    return np.fromiter((t.year * 12 + t.month - 1 for t in np.ravel(times)), dtype=int)
+
+def period_start(period):
+    """First day of a monthly period number, as a datetime."""
+    year, month = divmod(int(period), 12)
+    return datetime.datetime(year, month + 1, 1)
+
+def common_period(*indices):
+    """Integer positions of each dataset's time steps within the months covered by all of them.
+
+    Takes the `monthly_period_index` of each dataset and returns one array of
+    positions per dataset, for use with `isel`, covering the months from the
+    latest start to the earliest end. Raises ValueError if they don't overlap.
+    """
+    first = max(index.min() for index in indices)
+    last = min(index.max() for index in indices)
+    if first > last:
+        raise ValueError(f"No common period: latest start {first // 12}-{first % 12 + 1:02d} "
+                         f"is after earliest end {last // 12}-{last % 12 + 1:02d}")
+    return [np.flatnonzero((index >= first) & (index <= last)) for index in indices]
+
+def positions_to_slice(positions):
+    """A slice for consecutive positions (so `isel` returns a view, not a copy), else the positions."""
+    if len(positions) and np.all(np.diff(positions) == 1):
+        return slice(int(positions[0]), int(positions[-1]) + 1)
+    return positions
+
+def align_common_period(*data, time_dim="time"):
+    """The xarray objects cut to their common period with `isel`, each indexed once."""
+    positions = common_period(*(monthly_period_index(d[time_dim]) for d in data))
+    return [d.isel({time_dim: positions_to_slice(p)}) for d, p in zip(data, positions)]
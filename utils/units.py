@@ -1,3 +1,5 @@
+from collections import deque
+
 def mol_per_mol_to_ppbv(x):
     #Convert from mol/mol to ppbv.
     return x * 1e9
@@ -13,17 +15,57 @@ def mol_per_mol_to_pptv(x):
 def ppmv_to_mol_per_mol(x):
     return x * 1e-6
 
-# Dictionary for automatic unit conversion (if you want!)
+# Scale factors between units: value_in_to = value_in_from * factor.
+# The reverse direction is added automatically, and conversions between units
+# not listed together are chained through the shortest path (e.g. ppmv -> mol/mol -> pptv).
 CONVERSIONS = {
-    ("mol/mol", "ppbv"): mol_per_mol_to_ppbv,
-    ("ppbv", "mol/mol"): ppbv_to_mol_per_mol,
+    ("mol/mol", "ppbv"): 1e9,
+    ("mol/mol", "pptv"): 1e12,
+    ("ppmv", "mol/mol"): 1e-6,
+    ("mol/mol", "ppb"): 1e9,
+    ("mol/mol", "ppt"): 1e12,
+    ("ppm", "ppmv"): 1.0,
     # etc.
 }
 
-def convert(value, from_unit, to_unit):
+def register_conversion(from_unit, to_unit, factor):
+    """Add a scale factor to the registry."""
+    CONVERSIONS[(from_unit, to_unit)] = factor
+
+def _unit_graph():
+    graph = {}
+    for (a, b), factor in CONVERSIONS.items():
+        graph.setdefault(a, {})[b] = factor
+        graph.setdefault(b, {}).setdefault(a, 1 / factor)
+    return graph
+
+def conversion_factor(from_unit, to_unit):
+    """Single scale factor from `from_unit` to `to_unit` along the shortest chain of registered conversions."""
     if from_unit == to_unit:
+        return 1.0
+    graph = _unit_graph()
+    queue = deque([(from_unit, 1.0)])
+    seen = {from_unit}
+    while queue:
+        unit, factor = queue.popleft()
+        for neighbour, step in graph.get(unit, {}).items():
+            if neighbour == to_unit:
+                return factor * step
+            if neighbour not in seen:
+                seen.add(neighbour)
+                queue.append((neighbour, factor * step))
+    raise ValueError(f"No conversion from {from_unit} to {to_unit}")
+
+def convert(value, from_unit, to_unit, inplace=False):
+    """Convert with one multiply by the resolved factor.
+
+    With `inplace=True` a float NumPy or NumPy-backed xarray object is scaled in
+    place and returned, with no copy. Dask-backed data is always scaled lazily.
+    """
+    factor = conversion_factor(from_unit, to_unit)
+    if factor == 1.0:
+        return value
+    if inplace:
+        value *= factor
         return value
-    func = CONVERSIONS.get((from_unit, to_unit))
-    if func is None:
-        raise ValueError(f"No conversion from {from_unit} to {to_unit}")
-    return func(value)
+    return value * factor
@@ -0,0 +1,135 @@
+import hashlib
+import os
+import numpy as np
+import xarray as xr
+
+# ICAO standard atmosphere layers: base height (m), base temperature (K), lapse rate (K/m)
+STANDARD_ATMOSPHERE_LAYERS = [
+    (0.0, 288.15, -0.0065),
+    (11000.0, 216.65, 0.0),
+    (20000.0, 216.65, 0.001),
+    (32000.0, 228.65, 0.0028),
+    (47000.0, 270.65, 0.0),
+]
+SURFACE_PRESSURE_HPA = 1013.25
+GAS_CONSTANT_AIR = 287.053   # J kg-1 K-1
+GRAVITY = 9.80665            # m s-2
+
+PRESSURE_UNITS_TO_HPA = {"Pa": 0.01, "hPa": 1.0, "mb": 1.0, "mbar": 1.0}
+HEIGHT_UNITS_TO_KM = {"m": 1e-3, "metres": 1e-3, "meters": 1e-3, "km": 1.0}
+
+def _layer_base_pressures():
+    pressures = [SURFACE_PRESSURE_HPA]
+    for (h0, t0, lapse), (h1, _, _) in zip(STANDARD_ATMOSPHERE_LAYERS[:-1], STANDARD_ATMOSPHERE_LAYERS[1:]):
+        if lapse == 0:
+            pressures.append(pressures[-1] * np.exp(-GRAVITY * (h1 - h0) / (GAS_CONSTANT_AIR * t0)))
+        else:
+            pressures.append(pressures[-1] * (1 + lapse * (h1 - h0) / t0) ** (-GRAVITY / (GAS_CONSTANT_AIR * lapse)))
+    return pressures
+
+def pressure_to_altitude_km(p_hpa):
+    """Standard-atmosphere altitude (km) of pressures in hPa, valid up to about 1 hPa (~48 km)."""
+    p_hpa = np.asarray(p_hpa, dtype=float)
+    altitude = np.full(p_hpa.shape, np.nan)
+    for (h0, t0, lapse), p0 in zip(STANDARD_ATMOSPHERE_LAYERS, _layer_base_pressures()):
+        in_layer = p_hpa <= p0
+        if lapse == 0:
+            z = h0 - GAS_CONSTANT_AIR * t0 / GRAVITY * np.log(p_hpa / p0)
+        else:
+            z = h0 + t0 / lapse * ((p_hpa / p0) ** (-GAS_CONSTANT_AIR * lapse / GRAVITY) - 1)
+        # Layers go upwards, so each one overwrites the pressures above its base
+        altitude = np.where(in_layer | np.isnan(altitude), z, altitude)
+    return altitude / 1000
+
+def hybrid_height_altitude_km(a_m, b, orog_m):
+    """Altitude (km) of hybrid height levels, z = a + b * orography, broadcast over the orography's grid."""
+    return (a_m + b * orog_m) / 1000
+
+def model_altitude_km(ds, lev_dim="lev", orog=None):
+    """Altitude above sea level (km) of each model level, as a DataArray over `lev_dim` (and lat/lon if it varies).
+
+    Recognises, in order:
+    - UM hybrid height (level_height and sigma) or CMIP hybrid height (`lev_dim`
+      in m with b and orog/surface_altitude); `orog` may be given separately,
+      e.g. from the CMIP fx file. Without orography the levels are taken over sea level.
+    - pressure levels (Pa, hPa), through the standard atmosphere
+    - geometric heights (m, km)
+    """
+    if orog is None:
+        orog = next((ds[name] for name in ("surface_altitude", "orog") if name in ds), None)
+    if "level_height" in ds and "sigma" in ds:
+        a, b = ds["level_height"], ds["sigma"]
+    elif "b" in ds and ds[lev_dim].attrs.get("units") in HEIGHT_UNITS_TO_KM:
+        a = ds[lev_dim] * HEIGHT_UNITS_TO_KM[ds[lev_dim].attrs["units"]] * 1000
+        b = ds["b"]
+    else:
+        a = b = None
+    if a is not None:
+        return hybrid_height_altitude_km(a, b, orog if orog is not None else 0.0).rename("altitude")
+
+    units = ds[lev_dim].attrs.get("units")
+    if units in PRESSURE_UNITS_TO_HPA:
+        return xr.DataArray(pressure_to_altitude_km(ds[lev_dim].values * PRESSURE_UNITS_TO_HPA[units]),
+                            dims=lev_dim, coords={lev_dim: ds[lev_dim]}, name="altitude")
+    if units in HEIGHT_UNITS_TO_KM:
+        return (ds[lev_dim] * HEIGHT_UNITS_TO_KM[units]).rename("altitude")
+    raise ValueError(f"Can't work out altitudes for '{lev_dim}' with units {units!r}")
+
+def bin_membership(alt_km, bins, lev_axis=0):
+    """Boolean (n_bin, *alt_km.shape) of which levels of each column fall in each [alt_min, alt_max) bin."""
+    alt_km = np.moveaxis(np.asarray(alt_km), lev_axis, 0)
+    lo = np.array([b[0] for b in bins]).reshape((-1,) + (1,) * alt_km.ndim)
+    hi = np.array([b[1] for b in bins]).reshape((-1,) + (1,) * alt_km.ndim)
+    return np.moveaxis((alt_km >= lo) & (alt_km < hi), 1, lev_axis + 1)
+
+def interp_weights(alt_km, target_km, lev_axis=0):
+    """Linear interpolation weights from model levels onto target altitudes, for every column at once.
+
+    Returns (index, frac), each of shape (n_target, *columns): the value at a
+    target is level `index` * (1 - frac) + level `index + 1` * frac. frac is NaN
+    for targets below the lowest or above the highest level of a column.
+    """
+    alt_km = np.moveaxis(np.asarray(alt_km, dtype=float), lev_axis, 0)
+    if alt_km[0].mean() > alt_km[-1].mean():
+        raise ValueError("Levels must be ordered from the ground up")
+    target = np.asarray(target_km, dtype=float).reshape((-1,) + (1,) * (alt_km.ndim - 1))
+    # Number of levels at or below each target, per column
+    below = (alt_km[None] <= target[:, None]).sum(axis=1)
+    index = np.clip(below - 1, 0, alt_km.shape[0] - 2)
+    lower = np.take_along_axis(alt_km, index, axis=0) if alt_km.ndim > 1 else alt_km[index]
+    upper = np.take_along_axis(alt_km, index + 1, axis=0) if alt_km.ndim > 1 else alt_km[index + 1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        frac = (target - lower) / (upper - lower)
+    frac = np.where((below == 0) | (target > alt_km[-1]), np.nan, frac)
+    return index, frac
+
+def load_interp_weights(alt_km, target_km, lev_axis=0, cache_dir="cache"):
+    """`interp_weights`, saved to and reused from `cache_dir` keyed by a hash of the level and target altitudes."""
+    h = hashlib.sha1(np.ascontiguousarray(np.moveaxis(np.asarray(alt_km, dtype="f8"), lev_axis, 0)).tobytes())
+    h.update(np.asarray(target_km, dtype="f8").tobytes())
+    weights_file = os.path.join(cache_dir, "vertical", f"{h.hexdigest()[:16]}.npz")
+    if os.path.exists(weights_file):
+        with np.load(weights_file) as weights:
+            return weights["index"], weights["frac"]
+
+    index, frac = interp_weights(alt_km, target_km, lev_axis)
+    os.makedirs(os.path.dirname(weights_file), exist_ok=True)
+    tmp_file = weights_file[:-len(".npz")] + f".tmp{os.getpid()}.npz"
+    np.savez(tmp_file, index=index, frac=frac)
+    os.replace(tmp_file, weights_file)
+    return index, frac
+
+def apply_interp_weights(values, index, frac, lev_axis):
+    """Interpolate `values` along `lev_axis` with precomputed weights.
+
+    `index` and `frac` are (n_target, *columns) where the columns match the
+    trailing axes of `values` after the level axis (any leading axes, such as
+    time, are broadcast). The level axis of the result holds the targets.
+    """
+    lead = np.ndim(values) - index.ndim
+    values = np.moveaxis(np.asarray(values, dtype=float), lev_axis, lead)
+    shape = values.shape[:lead] + index.shape
+    index = np.broadcast_to(index, shape)
+    lower = np.take_along_axis(values, index, axis=lead)
+    upper = np.take_along_axis(values, index + 1, axis=lead)
+    return np.moveaxis(lower + (upper - lower) * frac, lead, lev_axis)